@@ -1,7 +1,11 @@
-import sounddevice as sd
 import numpy as np
+import struct
 from time_splits import time_splits
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
 
 def read_wav_file(wav_file):
     import numpy as np
@@ -26,14 +30,157 @@ def read_wav_file(wav_file):
     return audio, framerate
 
 
+# Locate the fmt and data chunks of a RIFF/RF64 WAV file without reading samples
+def read_wav_header(wav_file):
+    with open(wav_file, "rb") as f:
+        riff_id, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff_id not in (b"RIFF", b"RF64") or wave_id != b"WAVE":
+            raise ValueError(f"Not a WAV file: {wav_file}")
+
+        f.seek(0, 2)
+        file_size = f.tell()
+        f.seek(12)
+
+        fmt = None
+        data_offset = None
+        data_size = None
+        ds64_data_size = None
+        while f.tell() + 8 <= file_size:
+            chunk_id, chunk_size = struct.unpack("<4sI", f.read(8))
+            chunk_start = f.tell()
+
+            if chunk_id == b"ds64":
+                _, ds64_data_size = struct.unpack("<QQ", f.read(16))
+            elif chunk_id == b"fmt ":
+                body = f.read(chunk_size)
+                audio_format, n_channels, framerate = struct.unpack("<HHI", body[:8])
+                block_align, bits = struct.unpack("<HH", body[12:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # The sub-format GUID starts with the actual format tag
+                    audio_format = struct.unpack("<H", body[24:26])[0]
+                fmt = {
+                    "audio_format": audio_format,
+                    "n_channels": n_channels,
+                    "framerate": framerate,
+                    "block_align": block_align,
+                    "sampwidth": bits // 8,
+                }
+            elif chunk_id == b"data":
+                data_offset = chunk_start
+                if riff_id == b"RF64" and chunk_size == 0xFFFFFFFF:
+                    data_size = ds64_data_size
+                else:
+                    data_size = chunk_size
+                break
+
+            # Chunks are padded to an even number of bytes
+            f.seek(chunk_start + chunk_size + (chunk_size & 1))
+
+    if fmt is None or data_offset is None:
+        raise ValueError(f"Missing fmt or data chunk in: {wav_file}")
+
+    # Recorders that were cut off leave a wrong data size behind
+    data_size = min(data_size, file_size - data_offset)
+    fmt["data_offset"] = data_offset
+    fmt["n_frames"] = data_size // fmt["block_align"]
+    return fmt
+
+
+def _wav_sample_dtype(fmt):
+    sampwidth = fmt["sampwidth"]
+    if fmt["audio_format"] == WAVE_FORMAT_IEEE_FLOAT:
+        if sampwidth == 4:
+            return np.dtype("<f4")
+        if sampwidth == 8:
+            return np.dtype("<f8")
+    elif fmt["audio_format"] == WAVE_FORMAT_PCM:
+        if sampwidth == 1:
+            return np.dtype(np.uint8)
+        if sampwidth == 2:
+            return np.dtype("<i2")
+        if sampwidth == 3:
+            # No native 24-bit type, samples are exposed as raw 3-byte records
+            return np.dtype("V3")
+        if sampwidth == 4:
+            return np.dtype("<i4")
+    raise ValueError(
+        f"Unsupported WAV format {fmt['audio_format']} with {sampwidth*8}-bit samples"
+    )
+
+
+# Memory-map the PCM data as a (n_frames, n_channels) view without reading it
+def read_wav_mmap(wav_file):
+    fmt = read_wav_header(wav_file)
+    dtype = _wav_sample_dtype(fmt)
+    shape = (fmt["n_frames"], fmt["n_channels"])
+    if fmt["n_frames"] == 0:
+        audio = np.zeros(shape, dtype=dtype)
+    else:
+        audio = np.memmap(
+            wav_file, dtype=dtype, mode="r", offset=fmt["data_offset"], shape=shape
+        )
+    return audio, fmt["framerate"]
+
+
+# Convert a block of mapped PCM samples to dtype in [-1, 1). Samples of up to 24
+# bits are exact in float32, 32-bit and float64 samples are rounded to it.
+def pcm_to_float(block, dtype=np.float32):
+    dtype = np.dtype(dtype)
+    if block.dtype == np.dtype("V3"):
+        # 24-bit: assemble little-endian triplets in the top of an int32
+        b = np.ascontiguousarray(block).view(np.uint8).reshape(block.shape + (3,))
+        b = b.astype(np.int32)
+        out = (b[..., 0] << 8) | (b[..., 1] << 16) | (b[..., 2] << 24)
+        return out.astype(dtype) * dtype.type(1 / 2**31)
+    if block.dtype == np.uint8:
+        return (block.astype(dtype) - 128) * dtype.type(1 / 128)
+    if block.dtype.kind == "i":
+        scale = dtype.type(1 / 2 ** (8 * block.dtype.itemsize - 1))
+        return block.astype(dtype) * scale
+    return block.astype(dtype)
+
+
+# Convert a block of mapped PCM samples to float32 in [-1, 1)
+def pcm_to_float32(block):
+    return pcm_to_float(block, np.float32)
+
+
+# Yield fixed-size blocks of frames, optionally converted to float32
+def iter_wav_blocks(wav_file, block_size=65536, as_float32=False):
+    audio, framerate = read_wav_mmap(wav_file)
+    for start in range(0, len(audio), block_size):
+        block = audio[start : start + block_size]
+        yield pcm_to_float32(block) if as_float32 else block
+
+
+# Memory-mapped replacement for read_wav_file, converted block by block if asked
+def read_wav_file_mmap(wav_file, as_float32=False, block_size=65536):
+    audio, framerate = read_wav_mmap(wav_file)
+    if not as_float32:
+        return audio, framerate
+
+    out = np.empty(audio.shape, dtype=np.float32)
+    for start in range(0, len(audio), block_size):
+        out[start : start + block_size] = pcm_to_float32(
+            audio[start : start + block_size]
+        )
+    return out, framerate
+
+
+# sounddevice is imported on first playback, so analysis runs without PortAudio
 def play_segment(segment, framerate):
+    import sounddevice as sd
+
     if segment.size != 0:
         sd.play(segment, samplerate=framerate, blocking=True)
 
 
-def play_segments(segments, framerate):
+def play_segments(segments, framerate, splits=None):
+    if splits is None:
+        splits = time_splits
+
     for i, segment in enumerate(segments):
-        seg_start, seg_end = time_splits[i]
+        seg_start, seg_end = splits[i]
         print(f"Playing segment {i + 1}/{len(segments)}: {seg_start}s to {seg_end}s")
         play_segment(segment, framerate)
         if i < len(segments) - 1:
@@ -42,9 +189,14 @@ def play_segments(segments, framerate):
     print("All segments played!")
 
 
+# Play the frequencies back to back as steady sine tones, rendered in one pass
 def play_frequencies(peak_frequencies, duration=0.5):
+    import sounddevice as sd
+
+    from synth import render_note_events
+
     sample_rate = 44100
-    for i, freq in enumerate(peak_frequencies):
-        t = np.linspace(0, duration, int(sample_rate * duration), endpoint=False)
-        sine_wave = 0.1 * np.sin(2 * np.pi * freq * t)
-        sd.play(sine_wave, samplerate=sample_rate, blocking=True)
+    starts = np.arange(len(peak_frequencies)) * duration
+    events = {"start": starts, "end": starts + duration, "freq": peak_frequencies}
+    tones = render_note_events(events, sample_rate, decay=0.0, gain=0.1)
+    sd.play(tones, samplerate=sample_rate, blocking=True)
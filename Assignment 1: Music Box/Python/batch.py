@@ -0,0 +1,171 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+
+# Expand directories and glob patterns into a sorted list of WAV files
+def find_recordings(inputs):
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*.wav")
+        files.update(glob.glob(pattern, recursive=True))
+    return sorted(files)
+
+
+def _limit_worker_memory(max_memory_mb):
+    if max_memory_mb is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        # No address-space limits outside POSIX
+        return
+    limit = max_memory_mb * 1024**2
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+# JSON has no NaN, so missing values such as absent harmonics are stored as null
+def _to_json_value(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind != "f":
+            return value.tolist()
+        out = value.astype(object)
+        out[~np.isfinite(value)] = None
+        return out.tolist()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _result_to_json(result):
+    return {key: _to_json_value(value) for key, value in result.items()}
+
+
+def _result_path(wav_file, output_dir):
+    name = os.path.splitext(os.path.basename(wav_file))[0]
+    # Append a short hash of the full path so equal names in different folders differ
+    tag = hashlib.sha1(os.path.abspath(wav_file).encode()).hexdigest()[:8]
+    return os.path.join(output_dir, f"{name}-{tag}.json")
+
+
+# Analyse one file in a worker and write its result file
+def process_recording(wav_file, output_dir, analysis_kwargs):
+    from pipeline import analyse_recording
+
+    start = time.perf_counter()
+    result = analyse_recording(wav_file, **analysis_kwargs)
+    path = _result_path(wav_file, output_dir)
+    with open(path, "w") as f:
+        json.dump(_result_to_json(result), f, allow_nan=False)
+
+    return {
+        "wav_file": wav_file,
+        "result_file": path,
+        "status": "ok",
+        "n_segments": len(result["peak_frequencies"]),
+        "n_melody": int(np.sum(result["is_melody"])),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# Spread the files over a process pool. Each worker handles max_tasks_per_child
+# files before it is replaced, so memory fragmentation cannot build up overnight.
+def run_batch(
+    wav_files,
+    output_dir,
+    workers=None,
+    max_tasks_per_child=1,
+    max_memory_mb=None,
+    **analysis_kwargs,
+):
+    os.makedirs(output_dir, exist_ok=True)
+    summary = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        max_tasks_per_child=max_tasks_per_child,
+        initializer=_limit_worker_memory,
+        initargs=(max_memory_mb,),
+    ) as pool:
+        futures = {}
+        for wav_file in wav_files:
+            future = pool.submit(
+                process_recording, wav_file, output_dir, analysis_kwargs
+            )
+            futures[future] = wav_file
+        for i, future in enumerate(as_completed(futures)):
+            wav_file = futures[future]
+            try:
+                entry = future.result()
+            except Exception as error:
+                entry = {"wav_file": wav_file, "status": "error", "error": repr(error)}
+            summary.append(entry)
+            print(f"[{i + 1}/{len(futures)}] {entry['status']}: {wav_file}")
+
+    summary.sort(key=lambda entry: entry["wav_file"])
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Transcribe a batch of music-box recordings."
+    )
+    parser.add_argument("inputs", nargs="+", help="WAV files, directories or globs")
+    parser.add_argument("-o", "--output-dir", default="results")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--max-tasks-per-child", type=int, default=1)
+    parser.add_argument(
+        "--max-memory-mb",
+        type=int,
+        default=None,
+        help="address-space limit for each worker",
+    )
+    parser.add_argument("--adaptive-fft", action="store_true")
+    parser.add_argument("--refine-peaks", action="store_true")
+    parser.add_argument("--yin-below", type=float, default=None, metavar="SECONDS")
+    parser.add_argument(
+        "--decimation", type=int, nargs=2, default=None, metavar=("MELODY", "BASS")
+    )
+    parser.add_argument("--num-peaks", type=int, default=4)
+    parser.add_argument("--max-pitches", type=int, default=3)
+    parser.add_argument(
+        "--precision",
+        choices=["float32", "float64"],
+        default="float32",
+        help="sample type of the FFT input",
+    )
+    args = parser.parse_args(argv)
+    if args.adaptive_fft and args.decimation:
+        parser.error("--decimation cannot be combined with --adaptive-fft")
+
+    wav_files = find_recordings(args.inputs)
+    print(f"Found {len(wav_files)} recordings")
+    summary = run_batch(
+        wav_files,
+        args.output_dir,
+        workers=args.workers,
+        max_tasks_per_child=args.max_tasks_per_child,
+        max_memory_mb=args.max_memory_mb,
+        adaptive_fft=args.adaptive_fft,
+        refine_peaks=args.refine_peaks,
+        yin_below=args.yin_below,
+        decimation=args.decimation,
+        num_peaks=args.num_peaks,
+        max_pitches=args.max_pitches,
+        dtype=np.dtype(args.precision),
+    )
+    n_failed = sum(entry["status"] != "ok" for entry in summary)
+    print(f"Processed {len(summary) - n_failed} recordings, {n_failed} failed")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,291 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Notes a music box can play, C3 to C7
+MUSIC_BOX_NOTES = 440.0 * 2 ** (np.arange(-21, 40) / 12)
+
+
+# Synthetic music-box track: n_segments plucked notes with decaying harmonics and
+# random lengths that add up to duration. Returns int16 audio, the time_splits
+# style boundaries and the fundamental of every segment.
+def synth_music_box(duration, n_segments, framerate=44100, num_harmonics=4, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.uniform(0.2, 1.0, n_segments)
+    bounds = np.concatenate(([0.0], np.cumsum(lengths / lengths.sum() * duration)))
+    pitches = rng.choice(MUSIC_BOX_NOTES, n_segments)
+
+    audio = np.zeros(int(duration * framerate), dtype=np.float32)
+    for start, end, f0 in zip(bounds[:-1], bounds[1:], pitches):
+        i0, i1 = int(start * framerate), min(len(audio), int(end * framerate))
+        t = np.arange(i1 - i0, dtype=np.float32) / framerate
+        note = np.zeros_like(t)
+        for k in range(1, num_harmonics + 1):
+            if k * f0 < framerate / 2:
+                note += np.sin(2 * np.pi * k * f0 * t) / k**2
+        audio[i0:i1] = 0.5 * np.exp(-3 * t) * note
+
+    audio += rng.normal(0, 1e-4, len(audio)).astype(np.float32)
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    splits = [[round(s, 2), round(e, 2)] for s, e in zip(bounds[:-1], bounds[1:])]
+    return pcm, splits, pitches
+
+
+def write_wav(path, audio, framerate):
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(framerate)
+        wf.writeframes(audio.tobytes())
+
+
+# Time a stage repeat times and trace its peak Python/NumPy allocation once
+def measure(stage, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, {
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "peak_alloc_mb": peak / 1024**2,
+    }
+
+
+# Peak RSS of this process, or None where getrusage is not available
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024**2 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024**2
+
+
+# Run every stage of the analysis on one synthetic track
+def benchmark_track(duration, n_segments, repeat=3, plots=True, framerate=44100):
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    from audio import read_wav_file
+    from fft import (
+        add_zero_padding,
+        fft_segment,
+        fft_segments_batched,
+        find_harmonic_peaks,
+        find_harmonic_peaks_batched,
+        find_peak_frequencies,
+        find_peak_frequencies_batched,
+        plot_fft,
+        refine_peaks_zoom,
+    )
+    from helper_functions import (
+        freq_to_note,
+        freqs_to_notes,
+        plot_waveform,
+        split_into_segments,
+    )
+
+    pcm, splits, pitches = synth_music_box(duration, n_segments, framerate)
+    tmp_dir = tempfile.mkdtemp(prefix="music_box_bench_")
+    wav_file = os.path.join(tmp_dir, "track.wav")
+    write_wav(wav_file, pcm, framerate)
+
+    stages = {}
+
+    audio, stages["read_wav_file"] = measure(lambda: read_wav_file(wav_file)[0], repeat)
+    segments, stages["split_into_segments"] = measure(
+        lambda: split_into_segments(audio, framerate, splits=splits), repeat
+    )
+
+    target = 2 ** int(np.ceil(np.log2(max(len(s) for s in segments))))
+    padded, stages["add_zero_padding"] = measure(
+        lambda: [add_zero_padding(s, target) for s in segments], repeat
+    )
+    fft_segments, stages["fft_segment"] = measure(
+        lambda: [fft_segment(s, framerate) for s in padded], repeat
+    )
+    peaks, stages["find_peak_frequencies"] = measure(
+        lambda: find_peak_frequencies(fft_segments), repeat
+    )
+    _, stages["find_harmonic_peaks"] = measure(
+        lambda: [
+            find_harmonic_peaks(freqs, mag, peak_freq=peak)
+            for (freqs, mag), peak in zip(fft_segments, peaks)
+        ],
+        repeat,
+    )
+    _, stages["freq_to_note"] = measure(
+        lambda: [freq_to_note(f) for f in peaks], repeat
+    )
+    del padded, fft_segments
+
+    # Batched counterparts of the stages above
+    (fft_freqs, magnitudes), stages["fft_segments_batched"] = measure(
+        lambda: fft_segments_batched(segments, framerate), repeat
+    )
+    batched_peaks, stages["find_peak_frequencies_batched"] = measure(
+        lambda: find_peak_frequencies_batched(fft_freqs, magnitudes), repeat
+    )
+    _, stages["find_harmonic_peaks_batched"] = measure(
+        lambda: find_harmonic_peaks_batched(fft_freqs, magnitudes, batched_peaks),
+        repeat,
+    )
+    _, stages["freqs_to_notes"] = measure(lambda: freqs_to_notes(batched_peaks), repeat)
+    refined_peaks, stages["refine_peaks_zoom"] = measure(
+        lambda: refine_peaks_zoom(segments, framerate, batched_peaks, fft_freqs[1])[0],
+        repeat,
+    )
+
+    if plots:
+        # One figure of each kind is enough to follow the per-figure cost
+        png = os.path.join(tmp_dir, "figure.png")
+        longest = int(np.argmax([len(s) for s in segments]))
+        _, stages["plot_waveform"] = measure(
+            lambda: plot_waveform(segments[longest], framerate, save_path=png), 1
+        )
+        _, stages["plot_fft"] = measure(
+            lambda: plot_fft(fft_freqs, magnitudes[longest], save_path=png, show=False),
+            1,
+        )
+
+    # Accuracy against the synthesised pitches, to catch fast but wrong changes
+    cents = 1200 * np.log2(np.asarray(batched_peaks) / pitches)
+    refined_cents = 1200 * np.log2(refined_peaks / pitches)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        "duration_s": duration,
+        "n_segments": n_segments,
+        "framerate": framerate,
+        "stages": stages,
+        "max_abs_cents": float(np.max(np.abs(cents))),
+        "max_abs_cents_refined": float(np.max(np.abs(refined_cents))),
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+# Ignore changes smaller than this, sub-millisecond stages are mostly timer noise
+MIN_REGRESSION = {"median_s": 0.005, "peak_alloc_mb": 1.0, "max_rss_mb": 10.0}
+
+
+def _regressed(metric, old, new, tolerance):
+    return new > old * (1 + tolerance) and new - old > MIN_REGRESSION[metric]
+
+
+# Stages whose median time or peak allocation, and tracks whose peak RSS, grew by
+# more than tolerance compared with an earlier run
+def compare_results(current, baseline, tolerance=0.2):
+    previous = {(r["duration_s"], r["n_segments"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["duration_s"], result["n_segments"]))
+        if old is None:
+            continue
+
+        checks = []
+        if old["max_rss_mb"] is not None and result["max_rss_mb"] is not None:
+            checks.append(
+                ("track", "max_rss_mb", old["max_rss_mb"], result["max_rss_mb"])
+            )
+        for stage, stats in result["stages"].items():
+            if stage in old["stages"]:
+                for metric in ("median_s", "peak_alloc_mb"):
+                    checks.append(
+                        (stage, metric, old["stages"][stage][metric], stats[metric])
+                    )
+
+        for stage, metric, old_value, new_value in checks:
+            if _regressed(metric, old_value, new_value, tolerance):
+                regressions.append(
+                    {
+                        "duration_s": result["duration_s"],
+                        "n_segments": result["n_segments"],
+                        "stage": stage,
+                        "metric": metric,
+                        "baseline": old_value,
+                        "current": new_value,
+                    }
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the music-box analysis stages on synthetic tracks."
+    )
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 120, 270])
+    parser.add_argument("--segments", type=int, nargs="+", default=[14, 56, 224])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-plots", action="store_true")
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    # Every sweep point runs in a fresh process, so the peak RSS it reports is its
+    # own and does not depend on the points before it
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=1,
+        max_tasks_per_child=1,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        for duration in args.durations:
+            for n_segments in args.segments:
+                print(f"Benchmarking {duration:g} s with {n_segments} segments")
+                future = pool.submit(
+                    benchmark_track,
+                    duration,
+                    n_segments,
+                    repeat=args.repeat,
+                    plots=not args.no_plots,
+                )
+                results.append(future.result())
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to '{args.output}'")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline, args.tolerance)
+        for r in regressions:
+            print(
+                f"Regression in {r['stage']} ({r['duration_s']:g} s, "
+                f"{r['n_segments']} segments): {r['metric']} "
+                f"{r['baseline']:.4g} -> {r['current']:.4g}"
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".analysis_cache")
+CACHE_MAX_BYTES = 2 * 1024**3
+
+
+# Hash of a file's contents, read in chunks so large recordings are never loaded
+def file_digest(path, chunk_size=1 << 22):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot hash {type(value).__name__} in a cache key")
+
+
+# Key for a stage from everything its result depends on: upstream keys, segment
+# boundaries and analysis parameters
+def stage_key(name, *parts):
+    payload = json.dumps([name, *parts], default=_to_json, sort_keys=True)
+    return name + "-" + hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _entry_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+# Drop least recently used entries until the cache fits in max_bytes. The most
+# recent entry is always kept, even if it is larger than the limit on its own.
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    entries = [
+        entry
+        for entry in os.scandir(cache_dir)
+        if entry.is_dir() and not entry.name.startswith(".tmp-")
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+
+    total = 0
+    for i, entry in enumerate(entries):
+        total += _entry_size(entry.path)
+        if total > max_bytes and i > 0:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_arrays(key, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+
+    # Touch the entry so eviction sees it as recently used
+    os.utime(path)
+    arrays = {}
+    for filename in os.listdir(path):
+        name, ext = os.path.splitext(filename)
+        if ext == ".npy":
+            arrays[name] = np.load(os.path.join(path, filename), mmap_mode="r")
+    return arrays
+
+
+# Write every array as its own .npy file so it can be memory-mapped on load
+def save_arrays(key, arrays, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-")
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + ".npy"), np.asarray(array))
+
+    # mkdtemp creates the directory as 0700, give the entry the mode of a normal
+    # directory under the current umask
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_dir, 0o777 & ~umask)
+
+    path = os.path.join(cache_dir, key)
+    try:
+        os.replace(tmp_dir, path)
+    except OSError:
+        # Another run stored the same key first, its arrays are identical
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict(cache_dir, max_bytes)
+
+
+# Return the cached arrays for key, or compute, store and return them
+def cached_stage(key, compute, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    arrays = load_arrays(key, cache_dir)
+    if arrays is not None:
+        print(f"Loaded '{key}' from cache")
+        return arrays
+
+    save_arrays(key, compute(), cache_dir, max_bytes)
+    return load_arrays(key, cache_dir)
@@ -0,0 +1,84 @@
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# Samples summarised by one entry of the finest pyramid level
+BASE_BLOCK = 64
+
+# Pyramids of recently plotted signals, so zooming does not rebuild them
+PYRAMID_CACHE_SIZE = 16
+_pyramid_cache = OrderedDict()
+
+
+# Level k holds the min and max of every block of BASE_BLOCK * 2^k samples
+def build_minmax_pyramid(signal, base_block=BASE_BLOCK):
+    starts = np.arange(0, len(signal), base_block)
+    levels = [
+        (np.minimum.reduceat(signal, starts), np.maximum.reduceat(signal, starts))
+    ]
+    while len(levels[-1][0]) > 1:
+        lows, highs = levels[-1]
+        pairs = np.arange(0, len(lows), 2)
+        levels.append(
+            (np.minimum.reduceat(lows, pairs), np.maximum.reduceat(highs, pairs))
+        )
+    return levels
+
+
+# Cached pyramid for a signal. Entries are tied to the array object itself, so a
+# new array that reuses the memory of a freed one never gets a stale pyramid.
+def get_minmax_pyramid(signal, base_block=BASE_BLOCK):
+    key = (id(signal), base_block)
+    entry = _pyramid_cache.get(key)
+    if entry is not None and entry[0]() is signal:
+        _pyramid_cache.move_to_end(key)
+        return entry[1]
+
+    pyramid = build_minmax_pyramid(signal, base_block)
+    _pyramid_cache[key] = (weakref.ref(signal), pyramid)
+    _pyramid_cache.move_to_end(key)
+    if len(_pyramid_cache) > PYRAMID_CACHE_SIZE:
+        _pyramid_cache.popitem(last=False)
+    return pyramid
+
+
+def _bucket_minmax(lows, highs, n_buckets):
+    starts = np.unique(np.linspace(0, len(lows), n_buckets + 1).astype(np.int64)[:-1])
+    return (
+        starts,
+        np.minimum.reduceat(lows, starts),
+        np.maximum.reduceat(highs, starts),
+    )
+
+
+# Reduce a signal, or the [t_start, t_end) window of it, to min/max pairs for about
+# n_pixels columns. Returns interleaved values and their time axis, so the result
+# is drawn with a single plt.plot and looks the same as the full signal.
+def minmax_envelope(
+    signal, framerate, n_pixels=2000, t_start=None, t_end=None, base_block=BASE_BLOCK
+):
+    i0 = 0 if t_start is None else max(0, int(t_start * framerate))
+    i1 = len(signal) if t_end is None else min(len(signal), int(t_end * framerate))
+    if i1 - i0 <= 2 * n_pixels:
+        window = np.asarray(signal[i0:i1])
+        return window, np.arange(i0, i1) / framerate
+
+    samples_per_pixel = (i1 - i0) / n_pixels
+    if samples_per_pixel < base_block:
+        # Few samples per pixel, reducing the raw window is cheap
+        window = np.asarray(signal[i0:i1])
+        starts, lows, highs = _bucket_minmax(window, window, n_pixels)
+        starts = starts + i0
+    else:
+        pyramid = get_minmax_pyramid(signal, base_block)
+        level = min(int(np.log2(samples_per_pixel / base_block)), len(pyramid) - 1)
+        block = base_block * 2**level
+        lows, highs = pyramid[level]
+        b0, b1 = i0 // block, -(-i1 // block)
+        starts, lows, highs = _bucket_minmax(lows[b0:b1], highs[b0:b1], n_pixels)
+        starts = (starts + b0) * block
+
+    values = np.stack((lows, highs), axis=1).ravel()
+    times = np.repeat(starts / framerate, 2)
+    return values, times
@@ -1,6 +1,8 @@
 import numpy as np
 import os
-import matplotlib.pyplot as plt
+
+# Upper bound on the mixed-down segments held in memory at once by zoom_spectra
+ZOOM_BATCH_BYTES = 64 * 1024**2
 
 
 def fft_segment(signal, framerate):
@@ -13,6 +15,33 @@ def fft_segment(signal, framerate):
     return fft_freqs, magnitude
 
 
+# Write all segments into one zero-padded matrix and transform every row at once
+def fft_segments_batched(
+    segments, framerate, fft_size=None, dtype=np.float32, workers=-1
+):
+    import scipy.fft
+
+    max_length = max(len(segment) for segment in segments)
+    if fft_size is None:
+        # 2^a 3^b 5^c sizes are nearly as fast as a power of two but much shorter
+        fft_size = scipy.fft.next_fast_len(max_length, real=True)
+    if fft_size < max_length:
+        raise ValueError(
+            f"fft_size {fft_size} is shorter than a segment ({max_length})"
+        )
+
+    batch = np.zeros((len(segments), fft_size), dtype=dtype)
+    for i, segment in enumerate(segments):
+        batch[i, : len(segment)] = segment
+
+    spectra = scipy.fft.rfft(batch, axis=1, workers=workers, overwrite_x=True)
+    del batch
+    magnitudes = np.abs(spectra)
+    fft_freqs = np.fft.rfftfreq(fft_size, d=1 / framerate)
+
+    return fft_freqs, magnitudes
+
+
 def find_peak_frequencies(fft_segments):
     peak_frequencies = []
     for fft_freqs, magnitude in fft_segments:
@@ -23,6 +52,98 @@ def find_peak_frequencies(fft_segments):
     return peak_frequencies
 
 
+# Peak frequency of every row of a magnitude matrix sharing one frequency vector
+def find_peak_frequencies_batched(fft_freqs, magnitudes):
+    return fft_freqs[np.argmax(magnitudes, axis=1)]
+
+
+# Fractional peak positions from a parabola through each peak bin and its neighbours.
+# "gaussian" fits the parabola to log-magnitude, which is close to exact for a
+# Hann-windowed sinusoid, "quadratic" fits it to the linear magnitude.
+def interpolate_peaks(magnitudes, peak_indices, method="gaussian"):
+    magnitudes = np.atleast_2d(magnitudes)
+    peak_indices = np.atleast_1d(peak_indices)
+    rows = np.arange(len(magnitudes))
+    k = np.clip(peak_indices, 1, magnitudes.shape[1] - 2)
+
+    a = magnitudes[rows, k - 1].astype(np.float64)
+    b = magnitudes[rows, k].astype(np.float64)
+    c = magnitudes[rows, k + 1].astype(np.float64)
+    if method == "gaussian":
+        a, b, c = np.log(np.maximum((a, b, c), np.finfo(np.float64).tiny))
+    elif method != "quadratic":
+        raise ValueError(f"Unknown interpolation method: {method}")
+
+    denom = a - 2 * b + c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = np.where(denom < 0, 0.5 * (a - c) / denom, 0.0)
+    # No refinement at the spectrum edges, where the peak has a single neighbour
+    delta = np.where(k == peak_indices, np.clip(delta, -0.5, 0.5), 0.0)
+    amplitude = b - 0.25 * (a - c) * delta
+    if method == "gaussian":
+        amplitude = np.exp(amplitude)
+
+    return peak_indices + delta, amplitude
+
+
+# FFT size of a segment of n samples alone: pad_factor times its length
+def adaptive_fft_size(n, pad_factor=2):
+    import scipy.fft
+
+    return scipy.fft.next_fast_len(max(pad_factor * n, 2), real=True)
+
+
+# FFT sized for this segment alone: pad_factor times its length, Hann windowed
+def fft_segment_adaptive(signal, framerate, pad_factor=2, workers=-1, dtype=np.float32):
+    import scipy.fft
+
+    n = len(signal)
+    fft_size = adaptive_fft_size(n, pad_factor)
+    window = np.hanning(n).astype(dtype)
+    signal = np.asarray(signal).astype(dtype, copy=False)
+    fft_result = scipy.fft.rfft(signal * window, n=fft_size, workers=workers)
+    fft_freqs = np.fft.rfftfreq(fft_size, d=1 / framerate)
+    magnitude = np.abs(fft_result)
+
+    return fft_freqs, magnitude
+
+
+# fft_segment_adaptive of segments that share one fft_size, transformed as the
+# rows of one matrix
+def fft_segments_adaptive(segments, framerate, fft_size, workers=-1, dtype=np.float32):
+    import scipy.fft
+
+    batch = np.zeros((len(segments), fft_size), dtype=dtype)
+    for i, segment in enumerate(segments):
+        window = np.hanning(len(segment)).astype(dtype)
+        batch[i, : len(segment)] = np.asarray(segment).astype(dtype, copy=False)
+        batch[i, : len(segment)] *= window
+
+    spectra = scipy.fft.rfft(batch, axis=1, workers=workers, overwrite_x=True)
+    del batch
+    magnitudes = np.abs(spectra)
+    fft_freqs = np.fft.rfftfreq(fft_size, d=1 / framerate)
+
+    return fft_freqs, magnitudes
+
+
+# Peak frequency of each segment from its own short FFT and an interpolated argmax
+def find_peak_frequencies_adaptive(
+    segments, framerate, pad_factor=2, method="gaussian", dtype=np.float32
+):
+    peak_frequencies = np.zeros(len(segments))
+    for i, segment in enumerate(segments):
+        if len(segment) < 3:
+            continue
+        fft_freqs, magnitude = fft_segment_adaptive(
+            segment, framerate, pad_factor, dtype=dtype
+        )
+        peak_bin, _ = interpolate_peaks(magnitude, np.argmax(magnitude), method)
+        peak_frequencies[i] = peak_bin[0] * fft_freqs[1]
+
+    return peak_frequencies
+
+
 def add_zero_padding(segment, target_length):
     current_length = len(segment)
     if current_length >= target_length:
@@ -38,9 +159,16 @@ def plot_fft(
     harmonic_peaks=None,
     xlim=8000,
     index=None,
+    show=True,
+    save_path=None,
+    normalize=True,
 ):
-    # Plot the FFT magnitude spectrum with the highest peak as 0 dB
-    magnitude = magnitude / np.max(magnitude)
+    import matplotlib.pyplot as plt
+
+    # Plot the FFT magnitude spectrum with the highest peak as 0 dB, unless the
+    # caller has already scaled it
+    if normalize:
+        magnitude = magnitude / np.max(magnitude)
 
     plt.figure(figsize=(10, 4))
     plt.plot(fft_freqs, magnitude)
@@ -62,18 +190,22 @@ def plot_fft(
     plt.grid(True)
     plt.tight_layout()
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_dir = os.path.dirname(script_dir)
-    save_path = os.path.join(
-        script_dir,
-        "Overleaf",
-        "data",
-        "fft_spectrums",
-        "fft_spectrum_segment_{}.png".format(index if index is not None else "unknown"),
-    )
+    if save_path is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        script_dir = os.path.dirname(script_dir)
+        save_path = os.path.join(
+            script_dir,
+            "Overleaf",
+            "data",
+            "fft_spectrums",
+            "fft_spectrum_segment_{}.png".format(
+                index if index is not None else "unknown"
+            ),
+        )
     print("Saving figure to:", save_path)
     plt.savefig(save_path)
-    plt.show()
+    if show:
+        plt.show()
     plt.close()
 
 
@@ -99,3 +231,309 @@ def find_harmonic_peaks(
             peaks.append(fft_freqs[idx])
 
     return peaks
+
+
+# exp(-2j * pi * cycles * n) for n < m and every entry of cycles, along a new
+# last axis. Each row is the outer product of a coarse and a fine table, so only
+# about 2 * sqrt(m) complex exponentials have to be evaluated per entry.
+def _phasor(cycles, m, dtype=np.complex64):
+    cycles = np.asarray(cycles, dtype=np.float64)[..., None]
+    step = int(np.ceil(np.sqrt(m)))
+    fine = np.exp(-2j * np.pi * ((cycles * np.arange(step)) % 1.0)).astype(dtype)
+    coarse = np.exp(-2j * np.pi * ((cycles * step * np.arange(step)) % 1.0))
+    outer = coarse.astype(dtype)[..., :, None] * fine[..., None, :]
+    return outer.reshape(cycles.shape[:-1] + (step * step,))[..., :m]
+
+
+# Spectrum of every segment on n_points frequencies spanning span Hz around each
+# centre frequency, as a zoom FFT of the Hann-windowed segment: shift the centre
+# down to 0 Hz, low-pass and decimate with a triangular filter, then evaluate the
+# few remaining samples on the fine grid with one small DFT matrix. The filter's
+# droop across the band is divided out. centres is an (n_segments, n_centres)
+# array, NaN where nothing is wanted, and span may be given per column.
+#
+# The decimated rate is kept at least oversample times the span. Components that
+# alias into the band are then attenuated by at least (span / decimated rate)^2,
+# which keeps leakage from other partials around -60 dB.
+#
+# Segments are taken in order of length, in batches that are padded to their own
+# longest segment and stay below max_batch_bytes, and every batch is mixed down
+# and decimated for one column of centres at a time as a single array operation.
+def zoom_spectra(
+    segments,
+    framerate,
+    centres,
+    span,
+    n_points=32,
+    oversample=32,
+    max_batch_bytes=ZOOM_BATCH_BYTES,
+):
+    centres = np.asarray(centres, dtype=np.float64)
+    if len(segments) == 0:
+        shape = (0, int(np.prod(centres.shape[1:], dtype=np.int64)), n_points)
+        return np.empty(shape), np.empty(shape)
+
+    lengths = np.array([len(segment) for segment in segments], dtype=np.int64)
+    centres = centres.reshape(len(segments), -1)
+    spans = np.broadcast_to(np.asarray(span, dtype=np.float64), centres.shape[1:])
+    offsets = np.linspace(-spans / 2, spans / 2, n_points, axis=-1)
+    zoom_freqs = centres[..., None] + offsets
+
+    factors = np.maximum(1, (framerate / (oversample * spans)).astype(np.int64))
+    n_blocks = -(-max(lengths.max(), 1) // factors) + 1
+    decimated = [np.zeros((len(segments), n), dtype=np.complex128) for n in n_blocks]
+    valid = np.isfinite(centres) & (lengths[:, None] >= 2)
+
+    # Window, phasor and mixed-down samples, in float32 and complex64
+    sample_bytes = 4 + 8 + 8
+    order = np.argsort(lengths, kind="stable")
+    order = order[valid[order].any(axis=1)]
+    start = 0
+    while start < len(order):
+        # Lengths only grow along order, so the rows that fit form a prefix
+        batch_samples = np.arange(1, len(order) - start + 1) * lengths[order[start:]]
+        fits = np.count_nonzero(batch_samples * sample_bytes <= max_batch_bytes)
+        rows = order[start : start + max(1, fits)]
+        start += len(rows)
+
+        # Hann windows of every row at once, with the cosine as a phasor's real part
+        length = lengths[rows[-1]]
+        windowed = _phasor(-1.0 / (lengths[rows] - 1), length).real
+        windowed = 0.5 - 0.5 * windowed
+        for j, i in enumerate(rows):
+            windowed[j, : lengths[i]] *= segments[i]
+            windowed[j, lengths[i] :] = 0
+
+        for k, factor in enumerate(factors):
+            if not valid[rows, k].any():
+                continue
+            cycles = np.where(valid[rows, k], centres[rows, k], 0.0) / framerate
+            n = -(-length // factor)
+            mixed = np.zeros((len(rows), n * factor), dtype=np.complex64)
+            np.multiply(windowed, _phasor(cycles, length), out=mixed[:, :length])
+            # Triangle of length 2 * factor - 1, rising over one block and falling
+            # over the next. Both halves act on the interleaved real and imaginary
+            # parts of every block in one matrix product.
+            ramps = np.zeros((factor, 2, 2, 2), dtype=np.float32)
+            ramps[:, 0, 0, 0] = ramps[:, 1, 0, 1] = np.arange(1, factor + 1)
+            ramps[:, 0, 1, 0] = ramps[:, 1, 1, 1] = np.arange(factor - 1, -1, -1)
+            blocks = mixed.view(np.float32).reshape(-1, 2 * factor)
+            halves = blocks @ ramps.reshape(2 * factor, 4)
+            del mixed, blocks
+            halves = halves.astype(np.float64).view(np.complex128)
+            halves = halves.reshape(len(rows), n, 2)
+            decimated[k][rows, 1 : n + 1] += halves[..., 0]
+            decimated[k][rows, :n] += halves[..., 1]
+
+    magnitudes = np.empty(zoom_freqs.shape)
+    for k, factor in enumerate(factors):
+        times = np.arange(n_blocks[k]) * factor / framerate
+        dft = np.exp(-2j * np.pi * np.outer(times, offsets[k]))
+        response = factor * np.sinc(offsets[k] * factor / framerate)
+        response = (response / np.sinc(offsets[k] / framerate)) ** 2
+        magnitudes[:, k] = np.abs(decimated[k] @ dft) / response
+    magnitudes[~valid] = np.nan
+
+    return zoom_freqs, magnitudes
+
+
+# Refine coarse peak frequencies to a small fraction of bin_width, the bin width of
+# the spectrum they were picked from, by zooming in on +-bin_width around each one
+# and interpolating the argmax of the fine grid. coarse_freqs holds one peak per
+# segment or an (n_segments, n_peaks) array such as the harmonic_freqs of
+# find_harmonic_peaks_batched. bin_width may also be given per column, e.g. wider
+# for higher harmonics whose coarse position is less certain. Returns refined
+# frequencies and magnitudes.
+def refine_peaks_zoom(
+    segments, framerate, coarse_freqs, bin_width, n_points=32, method="gaussian"
+):
+    coarse_freqs = np.asarray(coarse_freqs, dtype=np.float64)
+    if len(segments) == 0:
+        return np.full(coarse_freqs.shape, np.nan), np.full(coarse_freqs.shape, np.nan)
+    zoom_freqs, magnitudes = zoom_spectra(
+        segments,
+        framerate,
+        coarse_freqs.reshape(len(segments), -1),
+        2 * np.asarray(bin_width, dtype=np.float64),
+        n_points,
+    )
+    zoom_freqs = zoom_freqs.reshape(-1, n_points)
+    magnitudes = magnitudes.reshape(-1, n_points)
+
+    refined = np.full(len(magnitudes), np.nan)
+    amplitudes = np.full(len(magnitudes), np.nan)
+    valid = ~np.isnan(magnitudes[:, 0])
+    if valid.any():
+        peak_bin, amplitudes[valid] = interpolate_peaks(
+            magnitudes[valid], np.argmax(magnitudes[valid], axis=1), method
+        )
+        step = (zoom_freqs[:, 1] - zoom_freqs[:, 0])[valid]
+        refined[valid] = zoom_freqs[valid, 0] + peak_bin * step
+
+    return refined.reshape(coarse_freqs.shape), amplitudes.reshape(coarse_freqs.shape)
+
+
+# Harmonic search for all segments at once. Harmonic bins are computed directly
+# from the uniform bin spacing, with an optional search of +-search_bins around
+# each one. Harmonics that are missing or below threshold are returned as NaN.
+def find_harmonic_peaks_batched(
+    fft_freqs,
+    magnitudes,
+    peak_freqs,
+    num_peaks=4,
+    threshold=0.001,
+    rel_tol=0.05,
+    search_bins=0,
+):
+    magnitudes = np.atleast_2d(magnitudes)
+    peak_freqs = np.atleast_1d(np.asarray(peak_freqs, dtype=np.float64))
+    n_bins = magnitudes.shape[1]
+    bin_width = fft_freqs[1] - fft_freqs[0]
+
+    max_mag = magnitudes.max(axis=1, keepdims=True)
+    max_mag = np.where(max_mag > 0, max_mag, 1)
+
+    targets = peak_freqs[:, None] * np.arange(1, num_peaks + 1)
+    in_range = targets <= fft_freqs[-1]
+    # A NaN fundamental, e.g. of an empty segment, has no harmonics in range
+    idx = np.rint(np.where(in_range, targets, 0) / bin_width).astype(np.int64)
+    idx = np.clip(idx, 0, n_bins - 1)
+
+    rows = np.arange(len(magnitudes))[:, None]
+    if search_bins > 0:
+        offsets = np.arange(-search_bins, search_bins + 1)
+        window = np.clip(idx[..., None] + offsets, 0, n_bins - 1)
+        best = np.argmax(magnitudes[rows[..., None], window], axis=2)
+        idx = np.take_along_axis(window, best[..., None], axis=2)[..., 0]
+
+    amplitudes = magnitudes[rows, idx] / max_mag
+    freqs = idx * bin_width
+    valid = (
+        in_range
+        & (np.abs(freqs - targets) <= rel_tol * targets)
+        & (amplitudes >= threshold)
+    )
+    # The fundamental itself is always reported, as in find_harmonic_peaks
+    valid[:, 0] = True
+    freqs = np.where(valid, freqs, np.nan)
+    freqs[:, 0] = peak_freqs
+    amplitudes = np.where(valid, amplitudes, np.nan)
+
+    return freqs, amplitudes
+
+
+# Several simultaneous fundamentals per segment from a harmonic-sum spectrum with
+# iterative cancellation. The spectra are max-pooled to pool_hz wide bins, where
+# harmonic h of the candidate in pooled bin c lands exactly in bin h * c. Every
+# iteration picks the most salient candidate in each row, refines it on the
+# original spectrum and removes its harmonics before the next pick.
+# Returns (n_segments, max_pitches) arrays of pitches and saliences relative to
+# the strongest pitch of the segment, NaN where fewer pitches were found.
+#
+# fundamentals, one per segment, fixes the first pitch to an already known
+# fundamental instead of the most salient candidate. Its harmonics are cancelled
+# as for a pick, and further pitches are relative to its salience.
+def find_multiple_pitches(
+    fft_freqs,
+    magnitudes,
+    fundamentals=None,
+    max_pitches=3,
+    num_harmonics=5,
+    fmin=60.0,
+    fmax=2000.0,
+    pool_hz=1.0,
+    min_salience=0.2,
+    cancel_width=0.03,
+):
+    magnitudes = np.atleast_2d(magnitudes)
+    n_rows = len(magnitudes)
+    rows = np.arange(n_rows)[:, None]
+    bin_width = fft_freqs[1] - fft_freqs[0]
+
+    # Max-pool the band that the candidates' harmonics can reach
+    bins_per_pool = max(1, int(round(pool_hz / bin_width)))
+    pool_hz = bins_per_pool * bin_width
+    n_pool = min(
+        int(np.ceil(num_harmonics * fmax / pool_hz)) + 2,
+        magnitudes.shape[1] // bins_per_pool,
+    )
+    pooled = (
+        magnitudes[:, : n_pool * bins_per_pool]
+        .reshape(n_rows, n_pool, bins_per_pool)
+        .max(axis=2)
+        .astype(np.float32)
+    )
+
+    # Candidate bins and the pooled bin of each of their harmonics
+    candidates = np.arange(
+        max(1, int(np.ceil(fmin / pool_hz))), int(fmax / pool_hz) + 1
+    )
+    harmonics = np.arange(1, num_harmonics + 1)
+    harmonic_bins = harmonics[:, None] * candidates[None, :]
+    in_band = harmonic_bins < n_pool
+    harmonic_bins = np.minimum(harmonic_bins, n_pool - 1)
+    weights = (1.0 / harmonics)[:, None] * in_band
+
+    pitches = np.full((n_rows, max_pitches), np.nan)
+    saliences = np.full((n_rows, max_pitches), np.nan)
+    reference = None
+    for p in range(max_pitches):
+        # Higher harmonics may drift by a bin, so they see their neighbours too
+        widened = pooled.copy()
+        widened[:, 1:] = np.maximum(widened[:, 1:], pooled[:, :-1])
+        widened[:, :-1] = np.maximum(widened[:, :-1], pooled[:, 1:])
+
+        if p == 0 and fundamentals is not None:
+            # Score the given fundamentals like candidates, wherever they lie
+            fundamentals = np.asarray(fundamentals, dtype=np.float64)
+            found = np.isfinite(fundamentals) & (fundamentals > 0)
+            f0_bins = np.rint(np.where(found, fundamentals, 0) / pool_hz)
+            f0_bins = f0_bins.astype(np.int64)
+            bins = harmonics[None, :] * f0_bins[:, None]
+            best_salience = np.sum(
+                widened[rows, np.minimum(bins, n_pool - 1)]
+                * ((bins < n_pool) / harmonics),
+                axis=1,
+            )
+            del widened
+            reference = np.where(best_salience > 0, best_salience, 1)
+            pitches[found, p] = fundamentals[found]
+            saliences[found, p] = (best_salience / reference)[found]
+        else:
+            if len(candidates) == 0:
+                # A spectrum too coarse to place any fundamental below fmax
+                break
+            salience = np.einsum("rhc,hc->rc", widened[:, harmonic_bins], weights)
+            del widened
+
+            best = np.argmax(salience, axis=1)
+            best_salience = salience[np.arange(n_rows), best]
+            if reference is None:
+                reference = np.where(best_salience > 0, best_salience, 1)
+            relative = best_salience / reference
+            found = relative >= min_salience
+            if not found.any():
+                break
+
+            # Refine on the full-resolution spectrum around the pooled pick
+            f0_bins = candidates[best]
+            lo = np.maximum((f0_bins - 1) * bins_per_pool, 0)
+            window = lo[:, None] + np.arange(3 * bins_per_pool)
+            window = np.minimum(window, magnitudes.shape[1] - 1)
+            peak = window[
+                np.arange(n_rows), np.argmax(magnitudes[rows, window], axis=1)
+            ]
+            pitches[found, p] = fft_freqs[peak][found]
+            saliences[found, p] = relative[found]
+
+        # Cancel +-cancel_width around every harmonic of the picked fundamentals
+        centers = harmonics[None, :] * f0_bins[:, None]
+        starts = np.clip(np.floor(centers * (1 - cancel_width)), 0, n_pool)
+        stops = np.clip(np.ceil(centers * (1 + cancel_width)) + 1, 0, n_pool)
+        edges = np.zeros((n_rows, n_pool + 1), dtype=np.int32)
+        np.add.at(edges, (rows, starts.astype(np.int64)), 1)
+        np.add.at(edges, (rows, stops.astype(np.int64)), -1)
+        cancel = (np.cumsum(edges, axis=1)[:, :n_pool] > 0) & found[:, None]
+        pooled[cancel] = 0
+
+    return pitches, saliences
@@ -1,20 +1,31 @@
-import sounddevice as sd
 import numpy as np
 import math
 import os
-import matplotlib.pyplot as plt
+import functools
 from time_splits import time_splits
+from audio import pcm_to_float
+from decimate import minmax_envelope
 
 
-def split_into_segments(audio, framerate):
+# Slices are views, so a memory-mapped input is only read when a segment is used.
+# Samples are converted to float32 with as_float32, or straight to dtype if given.
+def split_into_segments(audio, framerate, as_float32=False, splits=None, dtype=None):
+    if splits is None:
+        splits = time_splits
+    if as_float32 and dtype is None:
+        dtype = np.float32
+
     segments = []
-    for start, end in time_splits:
+    for start, end in splits:
         start_idx = max(0, int(start * framerate))
         end_idx = min(len(audio), int(end * framerate))
         if end_idx > start_idx:
-            segments.append(audio[start_idx:end_idx])
+            segment = audio[start_idx:end_idx]
         else:
-            segments.append(np.array([], dtype=audio.dtype))
+            segment = audio[:0]
+        if dtype is not None:
+            segment = pcm_to_float(segment, dtype)
+        segments.append(segment)
     return segments
 
 
@@ -33,6 +44,45 @@ def freq_to_note(freq):
     return note_names[note_index], octave, ideal_freq, deviation_cents
 
 
+NOTE_NAMES = np.array(["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"])
+
+# Semitone indices covered by the pitch table, relative to C4 (0.25 Hz to 270 kHz)
+PITCH_TABLE_MIN = -120
+PITCH_TABLE_MAX = 120
+
+
+# Ideal frequency of every semitone index in the table for a given reference A4
+@functools.lru_cache(maxsize=8)
+def pitch_table(reference=440.0):
+    n = np.arange(PITCH_TABLE_MIN, PITCH_TABLE_MAX + 1)
+    table = reference * 2.0 ** ((n - 9) / 12)
+    table.flags.writeable = False
+    return table
+
+
+# Vectorized freq_to_note: note index, octave, ideal frequency and cents deviation
+# for a whole array of frequencies. Non-positive frequencies give note index -1.
+def freqs_to_notes(freqs, reference=440.0):
+    freqs = np.asarray(freqs, dtype=np.float64)
+    valid = freqs > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.log2(np.where(valid, freqs, reference) / reference)
+    n = np.rint(12 * ratio).astype(np.int64) + 9
+    n = np.clip(n, PITCH_TABLE_MIN, PITCH_TABLE_MAX)
+
+    ideal_freqs = pitch_table(float(reference))[n - PITCH_TABLE_MIN]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deviation_cents = 1200 * np.log2(freqs / ideal_freqs)
+
+    note_index = np.where(valid, n % 12, -1)
+    octave = np.where(valid, n // 12 + 4, 0)
+    ideal_freqs = np.where(valid, ideal_freqs, np.nan)
+    deviation_cents = np.where(valid, deviation_cents, np.nan)
+
+    return note_index, octave, ideal_freqs, deviation_cents
+
+
 # Save notes to a text file
 def save_notes_to_file(filename, notes):
     with open(filename, "w") as f:
@@ -42,9 +92,19 @@ def save_notes_to_file(filename, notes):
             )
 
 
-def plot_waveform(segment, framerate, title="Waveform of Segment", index=None):
+def plot_waveform(
+    segment,
+    framerate,
+    title="Waveform of Segment",
+    index=None,
+    times=None,
+    save_path=None,
+):
+    import matplotlib.pyplot as plt
 
-    times = np.arange(len(segment)) / framerate
+    # Draw a per-pixel min/max envelope unless the segment is already decimated
+    if times is None:
+        segment, times = minmax_envelope(segment, framerate)
 
     plt.figure(figsize=(10, 4))
     plt.plot(times, segment)
@@ -53,15 +113,18 @@ def plot_waveform(segment, framerate, title="Waveform of Segment", index=None):
     plt.xlim(0, times[-1])
     plt.grid()
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_dir = os.path.dirname(script_dir)
-    save_path = os.path.join(
-        script_dir,
-        "Overleaf",
-        "data",
-        "time_plots",
-        "time_plot_segment_{}.png".format(index if index is not None else "unknown"),
-    )
+    if save_path is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        script_dir = os.path.dirname(script_dir)
+        save_path = os.path.join(
+            script_dir,
+            "Overleaf",
+            "data",
+            "time_plots",
+            "time_plot_segment_{}.png".format(
+                index if index is not None else "unknown"
+            ),
+        )
     print("Saving figure to:", save_path)
     plt.savefig(save_path)
     plt.close()
@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+
+from audio import iter_wav_blocks, pcm_to_float32, read_wav_header
+from fft import interpolate_peaks
+from helper_functions import NOTE_NAMES, freqs_to_notes
+
+
+# Block source reading a WAV file, as fast as possible or paced like a live input
+def wav_block_source(wav_file, block_size=512, realtime=False):
+    framerate = read_wav_header(wav_file)["framerate"]
+    start = time.perf_counter()
+    for i, block in enumerate(iter_wav_blocks(wav_file, block_size, as_float32=True)):
+        if realtime:
+            delay = start + (i + 1) * block_size / framerate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield block
+
+
+# Block source reading from the default (or given) input device
+def input_stream_source(framerate=44100, block_size=512, channels=1, device=None):
+    import sounddevice as sd
+
+    with sd.InputStream(
+        samplerate=framerate,
+        blocksize=block_size,
+        channels=channels,
+        dtype="float32",
+        device=device,
+    ) as stream:
+        while True:
+            block, overflowed = stream.read(block_size)
+            if overflowed:
+                print("Input overflow, samples were dropped")
+            yield block
+
+
+# Track the strongest pitch over a sliding window and yield a note event every
+# time a new note has been stable for min_frames hops. Samples go into a
+# preallocated ring buffer, so memory does not grow with the length of the input.
+#
+# Each event's latency is the wall-clock time from the arrival of the block that
+# completed the deciding frame until the event is emitted, plus the analysis delay
+# of one frame and the min_frames - 1 hops needed to confirm the note.
+def transcribe_stream(
+    blocks,
+    framerate,
+    frame_size=4096,
+    hop_size=512,
+    min_level=1e-3,
+    min_frames=3,
+    fmin=60.0,
+    fmax=4000.0,
+    reference=440.0,
+):
+    window = np.hanning(frame_size).astype(np.float32)
+    ring = np.zeros(frame_size, dtype=np.float32)
+    frame = np.empty(frame_size, dtype=np.float32)
+    bin_width = framerate / frame_size
+    lo = max(1, int(np.ceil(fmin / bin_width)))
+    hi = min(frame_size // 2, int(fmax / bin_width))
+    analysis_delay = (frame_size + (min_frames - 1) * hop_size) / framerate
+
+    write_pos = 0
+    n_seen = 0
+    since_hop = 0
+    candidate, count, current = None, 0, None
+
+    for block in blocks:
+        arrival = time.perf_counter()
+        block = np.asarray(block)
+        if block.dtype.kind != "f":
+            block = pcm_to_float32(block)
+        if block.ndim > 1:
+            block = block.mean(axis=1)
+
+        pos = 0
+        while pos < len(block):
+            take = min(len(block) - pos, hop_size - since_hop)
+            first = min(take, frame_size - write_pos)
+            ring[write_pos : write_pos + first] = block[pos : pos + first]
+            ring[: take - first] = block[pos + first : pos + take]
+            write_pos = (write_pos + take) % frame_size
+            pos += take
+            n_seen += take
+            since_hop += take
+            if since_hop < hop_size:
+                continue
+            since_hop = 0
+            if n_seen < frame_size:
+                continue
+
+            # Unroll the ring so the oldest sample comes first
+            frame[: frame_size - write_pos] = ring[write_pos:]
+            frame[frame_size - write_pos :] = ring[:write_pos]
+            if np.sqrt(np.mean(frame**2)) < min_level:
+                candidate, count, current = None, 0, None
+                continue
+
+            spectrum = np.abs(np.fft.rfft(frame * window))
+            peak = lo + np.argmax(spectrum[lo:hi])
+            peak_bin, _ = interpolate_peaks(spectrum, peak)
+            freq = peak_bin[0] * bin_width
+            note_index, octave, ideal_freq, cents = freqs_to_notes(freq, reference)
+            semitone = 12 * int(octave) + int(note_index)
+
+            if semitone == candidate:
+                count += 1
+            else:
+                candidate, count = semitone, 1
+            if count == min_frames and candidate != current:
+                current = candidate
+                yield {
+                    "time": n_seen / framerate,
+                    "note": str(NOTE_NAMES[note_index]),
+                    "octave": int(octave),
+                    "freq": float(freq),
+                    "ideal_freq": float(ideal_freq),
+                    "deviation_cents": float(cents),
+                    "latency": time.perf_counter() - arrival + analysis_delay,
+                }
@@ -1,93 +1,162 @@
 import numpy as np
-import sounddevice as sd
-import matplotlib.pyplot as plt
-import math
 
 from time_splits import time_splits
-from audio import *
-from helper_functions import *
-from fft import *
+from audio import read_wav_mmap
+from helper_functions import get_saving_path, save_notes_to_file, split_into_segments
+from fft import fft_segments_batched
+from onsets import detect_time_splits
+from pipeline import PRECISION, analyse_segments, classify_notes
+from render import render_figures, fft_plot_job, waveform_plot_job
+from cache import cached_stage, file_digest, stage_key
+from note_events import note_events_from_peaks, write_note_events
 import os
 
-
 WAV_FILE = os.path.join(os.path.dirname(__file__), "Pink_Panther_Music_Box.wav")
 
-# Read WAV file
-audio, framerate = read_wav_file(WAV_FILE)
-print(f"Loaded '{WAV_FILE}' with {len(audio)} samples at {framerate} Hz")
-
-# Split into segments
-segments = split_into_segments(audio, framerate)
-print(f"Split audio into {len(segments)} segments based on time_splits.")
-
-# Plot each segment's waveform
-for i, segment in enumerate(segments):
-    plot_waveform(segment, framerate, title=f"Waveform of Segment {i + 1}", index=i + 1)
-
-# Print the length of the longest segment
-max_segment_length = max(len(segment) for segment in segments)
-print(f"Longest segment length: {max_segment_length} samples")
-
-# Add zero-padding to each segment
-min_length = 2 ** int(np.ceil(np.log2(max_segment_length)))
-print(f"Zero-padding segments to length: {min_length} samples")
-padded_segments = []
-for i, segment in enumerate(segments):
-    padded_segment = add_zero_padding(segment, min_length)
-    padded_segments.append(padded_segment)
-
-# Compute FFT for each padded segment
-fft_segments = []
-for segment in padded_segments:
-    fft_freqs, magnitude = fft_segment(segment, framerate)
-    fft_segments.append((fft_freqs, magnitude))
-
-# Calculate the freqeuency resolution
-freq_resolution = framerate / min_length
-print(f"Frequency resolution of FFT: {freq_resolution:.2f} Hz")
-
-# Use FFT to find peak frequencies
-peak_frequencies = find_peak_frequencies(fft_segments)
-print("Identified peak frequencies for each segment.")
-
-# Find harmonic peaks for each segment
-harmonic_peaks = []
-for i, (fft_freqs, magnitude) in enumerate(fft_segments):
-    peak_freq = peak_frequencies[i]
-    peaks = find_harmonic_peaks(fft_freqs, magnitude, peak_freq=peak_freq)
-    harmonic_peaks.append(peaks)
-
-    # Plot FFT with harmonic peaks
-    plot_fft(
-        fft_freqs,
-        magnitude,
-        title=f"FFT Magnitude Spectrum for Note {i + 1}",
-        harmonic_peaks=peaks,
-        xlim=8000,
-        index=i + 1,
-    )
+# Use the hand-annotated time_splits, or detect note onsets from the audio
+DETECT_ONSETS = False
 
-# Separate melody and bass frequencies
-melody_freq = []
-melody_notes = []
-bass_freq = []
-bass_notes = []
+# Size each segment's FFT on its own, interpolate the peak between bins and
+# search that spectrum for harmonics instead of the zero-padded one
+ADAPTIVE_FFT = False
 
-for i, freq in enumerate(peak_frequencies):
-    note, octave, ideal_freq, deviation_cents = freq_to_note(freq)
+# Zoom in on every peak and harmonic to a small fraction of the FFT bin width
+REFINE_PEAKS = False
 
-    if freq >= 261.63:
-        melody_freq.append(freq)
-        melody_notes.append((i, note, octave, freq, ideal_freq, deviation_cents))
-    else:
-        bass_freq.append(freq)
-        bass_notes.append((i, note, octave, freq, ideal_freq, deviation_cents))
+# Harmonic search parameters, part of the analysis cache key
+HARMONIC_PARAMS = {"num_peaks": 4, "threshold": 0.001, "rel_tol": 0.05}
 
 
-# Save melody and bass notes to text files
-melody_notes_path = get_saving_path("text", "melody_notes.txt")
-bass_notes_path = get_saving_path("text", "bass_notes.txt")
-save_notes_to_file(melody_notes_path, melody_notes)
-save_notes_to_file(bass_notes_path, bass_notes)
-print("Saved melody notes to 'melody_notes.txt'")
-print("Saved bass notes to 'bass_notes.txt'")
+# Everything runs from here, so importing this module has no side effects. The
+# analysis itself is pipeline.analyse_segments, run one cached stage at a time,
+# this adds figures and files.
+def main():
+    # Memory-map WAV file, only the samples inside a segment are read from disk
+    audio, framerate = read_wav_mmap(WAV_FILE)
+    audio = audio[:, 0]
+    print(f"Loaded '{WAV_FILE}' with {len(audio)} samples at {framerate} Hz")
+
+    if DETECT_ONSETS:
+        splits = detect_time_splits(audio, framerate)
+        print(f"Detected {len(splits)} note onsets.")
+    else:
+        splits = time_splits
+    segments = split_into_segments(audio, framerate, splits=splits, dtype=PRECISION)
+    source = "detected note onsets" if DETECT_ONSETS else "time_splits"
+    print(f"Split audio into {len(segments)} segments based on {source}.")
+
+    # Queue each segment's waveform plot, figures are rendered together at the end
+    figure_jobs = [
+        waveform_plot_job(segment, framerate, index=i + 1)
+        for i, segment in enumerate(segments)
+    ]
+
+    # Print the length of the longest segment
+    max_segment_length = max(len(segment) for segment in segments)
+    print(f"Longest segment length: {max_segment_length} samples")
+
+    # Each stage below is cached under a key of its inputs, so reruns only
+    # recompute the stages whose audio, boundaries or parameters changed
+    digest = file_digest(WAV_FILE)
+
+    # Zero-pad all segments into one matrix and compute every FFT in one call,
+    # for the FFT plots and the analysis alike
+    def compute_spectra():
+        fft_freqs, magnitudes = fft_segments_batched(
+            segments, framerate, dtype=PRECISION
+        )
+        return {"fft_freqs": fft_freqs, "magnitudes": magnitudes}
+
+    spectra_key = stage_key("spectra", digest, splits, np.dtype(PRECISION).name)
+    spectra = cached_stage(spectra_key, compute_spectra)
+    fft_freqs, magnitudes = spectra["fft_freqs"], spectra["magnitudes"]
+    print(f"Zero-padding segments to length: {round(framerate / fft_freqs[1])} samples")
+
+    # The adaptive analysis transforms every segment on its own instead
+    analysis_kwargs = {
+        "adaptive_fft": ADAPTIVE_FFT,
+        "refine_peaks": REFINE_PEAKS,
+        "spectra": None if ADAPTIVE_FFT else (fft_freqs, magnitudes),
+        "dtype": PRECISION,
+    }
+
+    # Final fundamental of every segment
+    def compute_peaks():
+        return analyse_segments(segments, framerate, harmonics=False, **analysis_kwargs)
+
+    peaks_key = stage_key("peaks", spectra_key, ADAPTIVE_FFT, REFINE_PEAKS)
+    peak_frequencies = cached_stage(peaks_key, compute_peaks)["peak_frequencies"]
+    peak_frequencies = np.asarray(peak_frequencies)
+    print("Identified peak frequencies for each segment.")
+
+    # Harmonics and further pitches, searched from those fundamentals
+    def compute_harmonics():
+        result = analyse_segments(
+            segments,
+            framerate,
+            peak_frequencies=peak_frequencies,
+            **analysis_kwargs,
+            **HARMONIC_PARAMS,
+        )
+        del result["peak_frequencies"]
+        return result
+
+    harmonics_key = stage_key("harmonics", spectra_key, peaks_key, HARMONIC_PARAMS)
+    harmonics = cached_stage(harmonics_key, compute_harmonics)
+
+    # Calculate the freqeuency resolution
+    freq_resolution = fft_freqs[1] - fft_freqs[0]
+    print(f"Frequency resolution of FFT: {freq_resolution:.2f} Hz")
+
+    # Queue FFT plots with harmonic peaks
+    harmonic_peaks = [row[~np.isnan(row)] for row in harmonics["harmonic_freqs"]]
+    for i, magnitude in enumerate(magnitudes):
+        figure_jobs.append(
+            fft_plot_job(
+                fft_freqs,
+                magnitude,
+                harmonic_peaks=harmonic_peaks[i],
+                xlim=8000,
+                index=i + 1,
+            )
+        )
+
+    # Render all figures in parallel, skipping those whose inputs have not changed
+    render_figures(figure_jobs)
+
+    # Separate melody and bass frequencies
+    result = classify_notes(peak_frequencies)
+    is_melody = result["is_melody"]
+    notes = list(
+        zip(
+            range(len(peak_frequencies)),
+            result["note"],
+            result["octave"],
+            peak_frequencies,
+            result["ideal_freq"],
+            result["deviation_cents"],
+        )
+    )
+    melody_notes = [notes[i] for i in np.flatnonzero(is_melody)]
+    bass_notes = [notes[i] for i in np.flatnonzero(~is_melody)]
+
+    # Save melody and bass notes to text files
+    melody_notes_path = get_saving_path("text", "melody_notes.txt")
+    bass_notes_path = get_saving_path("text", "bass_notes.txt")
+    save_notes_to_file(melody_notes_path, melody_notes)
+    save_notes_to_file(bass_notes_path, bass_notes)
+    print("Saved melody notes to 'melody_notes.txt'")
+    print("Saved bass notes to 'bass_notes.txt'")
+
+    # Save the same notes as typed columns, which can be read back without parsing.
+    # Segments are numbered from 1 as in the text files.
+    events = note_events_from_peaks(splits, peak_frequencies, first_segment=1)
+    for name, mask in (("melody_notes", is_melody), ("bass_notes", ~is_melody)):
+        write_note_events(
+            get_saving_path("text", name), {k: v[mask] for k, v in events.items()}
+        )
+    print("Saved melody and bass note events to 'melody_notes/' and 'bass_notes/'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from fft import fft_segments_batched
+
+# Taps of the anti-alias filter per output sample. 16 gives a stopband below
+# -80 dB and a passband that is flat to within 0.01 dB up to PASSBAND times the
+# new Nyquist frequency.
+TAPS_PER_PHASE = 16
+PASSBAND = 0.6
+
+# Window samples multiplied at once by decimate, about 1 MB in float32
+DECIMATE_CHUNK = 2**18
+
+
+# Kaiser-windowed sinc low-pass with its cutoff at the Nyquist frequency after
+# decimating by factor and unity gain at DC. The odd-length symmetric filter is
+# padded with one zero to factor * taps_per_phase taps, so its delay is a whole
+# number of samples.
+@lru_cache(maxsize=None)
+def lowpass_filter(factor, taps_per_phase=TAPS_PER_PHASE):
+    n_taps = factor * taps_per_phase - 1
+    n = np.arange(n_taps) - (n_taps - 1) / 2
+    h = np.sinc(n / factor) * np.kaiser(n_taps, 8.0)
+    h = np.append(h / h.sum(), 0.0)
+    h.flags.writeable = False
+    return h
+
+
+# Low-pass a signal and keep every factor-th sample, computing only the samples
+# that are kept: each output sample is the dot product of the filter with a
+# window of the input that moves on by factor samples per output sample, so
+# every input sample costs taps_per_phase multiply-adds whatever the factor.
+# The windows are copied in cache-sized chunks into one buffer for matmul.
+# Output sample n is centred on input sample n * factor, and the output has
+# ceil(len(signal) / factor) samples.
+def decimate(signal, factor, taps_per_phase=TAPS_PER_PHASE):
+    signal = np.asarray(signal)
+    dtype = signal.dtype if signal.dtype.kind == "f" else np.float64
+    if factor == 1:
+        return signal.astype(dtype, copy=False)
+
+    h = lowpass_filter(factor, taps_per_phase)[::-1].astype(dtype)
+    n_out = -(-len(signal) // factor)
+    pad_left = len(h) - 1 - (len(h) - 2) // 2
+
+    padded = np.zeros(n_out * factor + len(h), dtype=dtype)
+    padded[pad_left : pad_left + len(signal)] = signal
+    windows = sliding_window_view(padded, len(h))[::factor]
+
+    out = np.empty(n_out, dtype=dtype)
+    chunk = max(1, min(n_out, DECIMATE_CHUNK // len(h)))
+    buffer = np.empty((chunk, len(h)), dtype=dtype)
+    for start in range(0, n_out, chunk):
+        stop = min(n_out, start + chunk)
+        np.copyto(buffer[: stop - start], windows[start:stop])
+        np.matmul(buffer[: stop - start], h, out=out[start:stop])
+    return out
+
+
+# Band-split views of the segments: each band is decimated from the previous one,
+# so factors (2, 8) gives the segments at framerate / 2 and at framerate / 8.
+# Every factor must divide the next. Returns a list of (segments, band rate).
+def band_split(segments, framerate, factors):
+    bands = []
+    previous = 1
+    for factor in factors:
+        if factor % previous:
+            raise ValueError(
+                f"Decimation factor {factor} is not a multiple of {previous}"
+            )
+        segments = [decimate(segment, factor // previous) for segment in segments]
+        bands.append((segments, framerate / factor))
+        previous = factor
+    return bands
+
+
+# Magnitude spectra of segments decimated by factor, on the frequency axis of an
+# fft_size transform at the full framerate. fft_size / factor points at the band
+# rate have the same bin spacing, so the band's bins are the first bins of the
+# full axis, and scaling by factor makes up for the fewer samples summed in each
+# bin. The peak and harmonic searches of fft.py can then be applied unchanged.
+# Only the bins up to passband times the band's Nyquist frequency are returned,
+# so no search looks at partials the anti-alias filter has attenuated.
+def band_spectra(
+    band_segments, framerate, factor, fft_size, dtype=np.float32, passband=PASSBAND
+):
+    if fft_size % factor:
+        raise ValueError(f"fft_size {fft_size} is not a multiple of {factor}")
+    _, magnitudes = fft_segments_batched(
+        band_segments, framerate / factor, fft_size=fft_size // factor, dtype=dtype
+    )
+    if factor > 1:
+        n_bins = min(magnitudes.shape[1], int(passband * fft_size / factor / 2) + 1)
+        magnitudes = magnitudes[:, :n_bins]
+    magnitudes *= factor
+    fft_freqs = np.arange(magnitudes.shape[1]) * (framerate / fft_size)
+    return fft_freqs, magnitudes
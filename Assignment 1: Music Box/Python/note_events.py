@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+from helper_functions import NOTE_NAMES, freqs_to_notes
+
+# One raw little-endian file per column. Notes are stored as their index in
+# NOTE_NAMES, -1 where no note was found.
+NOTE_EVENT_COLUMNS = {
+    "segment": "<i4",
+    "start": "<f8",
+    "end": "<f8",
+    "freq": "<f8",
+    "note": "<i1",
+    "octave": "<i1",
+    "cents": "<f4",
+}
+SCHEMA_FILE = "schema.json"
+
+
+def _column_path(path, name):
+    return os.path.join(path, name + ".bin")
+
+
+def _create(path):
+    os.makedirs(path, exist_ok=True)
+    schema_path = os.path.join(path, SCHEMA_FILE)
+    if not os.path.exists(schema_path):
+        with open(schema_path, "w") as f:
+            json.dump({"version": 1, "columns": NOTE_EVENT_COLUMNS}, f, indent=2)
+
+
+# Note events for segments from their boundaries and peak frequencies
+def note_events_from_peaks(splits, peak_frequencies, first_segment=0):
+    splits = np.asarray(splits, dtype=np.float64).reshape(-1, 2)
+    note_index, octave, _, cents = freqs_to_notes(peak_frequencies)
+    return {
+        "segment": np.arange(first_segment, first_segment + len(splits)),
+        "start": splits[:, 0],
+        "end": splits[:, 1],
+        "freq": np.asarray(peak_frequencies),
+        "note": note_index,
+        "octave": octave,
+        "cents": cents,
+    }
+
+
+# Append a batch of events, given as a dict of equally long columns. Every column
+# file is only ever appended to, so events can be written as they are produced.
+def append_note_events(path, events):
+    _create(path)
+    n = len(events["segment"])
+    columns = {}
+    for name, dtype in NOTE_EVENT_COLUMNS.items():
+        column = np.asarray(events[name])
+        if name == "note" and column.dtype.kind in "US":
+            column = np.array([list(NOTE_NAMES).index(str(s)) for s in column])
+        if len(column) != n:
+            raise ValueError(f"Column '{name}' has {len(column)} rows, expected {n}")
+        columns[name] = column.astype(dtype)
+
+    for name, column in columns.items():
+        with open(_column_path(path, name), "ab") as f:
+            f.write(column.tobytes())
+
+
+# Replace any existing events at path with events
+def write_note_events(path, events):
+    for name in NOTE_EVENT_COLUMNS:
+        if os.path.exists(_column_path(path, name)):
+            os.remove(_column_path(path, name))
+    append_note_events(path, events)
+
+
+# Columns of a stored transcription, memory-mapped unless mmap is False. Rows of
+# an append that was cut off half-way are left out.
+def read_note_events(path, mmap=True):
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        columns = json.load(f)["columns"]
+
+    sizes = {}
+    for name, dtype in columns.items():
+        column_path = _column_path(path, name)
+        size = os.path.getsize(column_path) if os.path.exists(column_path) else 0
+        sizes[name] = size // np.dtype(dtype).itemsize
+    n = min(sizes.values())
+
+    events = {}
+    for name, dtype in columns.items():
+        if n == 0:
+            events[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            events[name] = np.memmap(
+                _column_path(path, name), dtype=dtype, mode="r", shape=(n,)
+            )
+        else:
+            events[name] = np.fromfile(_column_path(path, name), dtype=dtype, count=n)
+    return events
+
+
+# Rows as plain Python values, with note names and None for missing cents
+def _export_rows(events):
+    names = np.where(events["note"] >= 0, NOTE_NAMES[events["note"]], "")
+    for i in range(len(events["segment"])):
+        yield {
+            "segment": int(events["segment"][i]),
+            "start": float(events["start"][i]),
+            "end": float(events["end"][i]),
+            "freq": float(events["freq"][i]),
+            "note": str(names[i]),
+            "octave": int(events["octave"][i]),
+            "cents": (
+                None if np.isnan(events["cents"][i]) else float(events["cents"][i])
+            ),
+        }
+
+
+def export_note_events_csv(path, csv_file):
+    with open(csv_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(NOTE_EVENT_COLUMNS))
+        writer.writeheader()
+        writer.writerows(_export_rows(read_note_events(path)))
+
+
+def export_note_events_json(path, json_file):
+    with open(json_file, "w") as f:
+        json.dump(list(_export_rows(read_note_events(path))), f, indent=2)
@@ -0,0 +1,117 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from audio import pcm_to_float32
+
+
+def _as_mono_float32(block):
+    block = np.asarray(block)
+    if block.dtype.kind == "f":
+        block = block.astype(np.float32, copy=False)
+    else:
+        block = pcm_to_float32(block)
+    if block.ndim > 1:
+        block = block.mean(axis=1, dtype=np.float32)
+    return block
+
+
+# Detect note onsets with half-wave rectified spectral flux in a single pass.
+# Only one frame of audio and mean_window seconds of flux are kept between blocks,
+# so this works on live input as well as on a file. The first frame has no flux,
+# so it is reported as an onset at 0 s if its RMS level is above first_level.
+def iter_onsets(
+    blocks,
+    framerate,
+    frame_size=2048,
+    hop_size=512,
+    delta=0.05,
+    mean_window=0.5,
+    min_gap=0.03,
+    compression=100.0,
+    first_level=0.01,
+):
+    window = np.hanning(frame_size).astype(np.float32)
+    n_mean = max(1, int(round(mean_window * framerate / hop_size)))
+    min_gap_frames = max(1, int(round(min_gap * framerate / hop_size)))
+
+    buffer = np.zeros(0, dtype=np.float32)
+    prev_mag = None
+    flux_tail = np.zeros(0, dtype=np.float32)
+    next_frame = 0
+    last_onset = -min_gap_frames
+
+    for block in blocks:
+        buffer = np.concatenate((buffer, _as_mono_float32(block)))
+        if len(buffer) < frame_size:
+            continue
+        n_frames = (len(buffer) - frame_size) // hop_size + 1
+
+        frames = sliding_window_view(buffer, frame_size)[::hop_size][:n_frames]
+        mag = np.log1p(compression * np.abs(np.fft.rfft(frames * window, axis=1)))
+        mag = mag.astype(np.float32, copy=False)
+        buffer = buffer[n_frames * hop_size :]
+        if prev_mag is None:
+            # The very first frame has no predecessor and gets no flux value
+            if np.sqrt(np.mean(np.square(frames[0], dtype=np.float64))) > first_level:
+                last_onset = 0
+                yield 0.0
+            prev_mag = mag[0]
+            mag = mag[1:]
+            next_frame = 1
+            if len(mag) == 0:
+                continue
+
+        diff = np.diff(mag, axis=0, prepend=prev_mag[None, :])
+        flux = np.maximum(diff, 0).mean(axis=1)
+        prev_mag = mag[-1]
+
+        # The last frame of the previous block is still waiting for its right neighbour
+        f = np.concatenate((flux_tail, flux))
+        first = next_frame - len(flux_tail)
+        candidates = np.arange(max(len(flux_tail) - 1, 1), len(f) - 1)
+
+        csum = np.concatenate(([0.0], np.cumsum(f, dtype=np.float64)))
+        lo = np.maximum(candidates - n_mean, 0)
+        local_mean = (csum[candidates] - csum[lo]) / (candidates - lo)
+
+        is_peak = (
+            (f[candidates] > f[candidates - 1])
+            & (f[candidates] >= f[candidates + 1])
+            & (f[candidates] > local_mean + delta)
+        )
+        for j in candidates[is_peak]:
+            frame = first + j
+            if frame - last_onset >= min_gap_frames:
+                last_onset = frame
+                # Report the start of the newest hop in the frame
+                yield (frame * hop_size + frame_size - hop_size) / framerate
+
+        next_frame += len(flux)
+        flux_tail = f[-(n_mean + 1) :]
+
+
+# Turn onset times into the contiguous [start, end] pairs used by time_splits
+def onsets_to_time_splits(onset_times, end_time, decimals=2):
+    bounds = [round(t, decimals) for t in onset_times] + [round(end_time, decimals)]
+    return [[start, end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+# Segment a whole signal or a stream of blocks into a time_splits-style table
+def detect_time_splits(source, framerate, block_size=65536, **onset_kwargs):
+    n_samples = 0
+
+    if isinstance(source, np.ndarray):
+        audio = source
+        source = (
+            audio[start : start + block_size]
+            for start in range(0, len(audio), block_size)
+        )
+
+    def counted(blocks):
+        nonlocal n_samples
+        for block in blocks:
+            n_samples += len(block)
+            yield block
+
+    onset_times = list(iter_onsets(counted(source), framerate, **onset_kwargs))
+    return onsets_to_time_splits(onset_times, n_samples / framerate)
@@ -0,0 +1,106 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Frames transformed together, bounds the FFT matrix at a few tens of MB
+MAX_FRAMES_PER_BATCH = 1024
+
+
+# Cumulative mean normalized difference function of YIN for every row of frames,
+# for lags 0 .. max_lag. The difference function of each lag comes from the
+# energies of the two windows and their cross-correlation, all computed with one
+# batched FFT, so the cost per frame depends only on the frame size.
+def yin_difference(frames, max_lag, dtype=np.float32):
+    frames = np.asarray(frames).astype(dtype, copy=False)
+    frame_size = frames.shape[1]
+    width = frame_size - max_lag
+    fft_size = 1 << int(np.ceil(np.log2(frame_size + width)))
+
+    head = np.fft.rfft(frames[:, :width], fft_size, axis=1)
+    full = np.fft.rfft(frames, fft_size, axis=1)
+    corr = np.fft.irfft(np.conj(head) * full, fft_size, axis=1)[:, : max_lag + 1]
+
+    # Energies are summed in float64, the dip is a small difference of them
+    squares = np.cumsum(frames**2, axis=1, dtype=np.float64)
+    squares = np.concatenate((np.zeros((len(frames), 1)), squares), axis=1)
+    lags = np.arange(max_lag + 1)
+    energy_lag = squares[:, lags + width] - squares[:, lags]
+    diff = np.maximum(squares[:, [width]] + energy_lag - 2 * corr, 0.0)
+
+    cmndf = np.ones_like(diff)
+    running = np.cumsum(diff[:, 1:], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cmndf[:, 1:] = np.where(running > 0, diff[:, 1:] * lags[1:] / running, 1.0)
+    return cmndf
+
+
+# YIN estimate for every row of frames: the first dip of the normalized
+# difference below threshold, refined by a parabola through its neighbours.
+# Returns f0 (NaN for unvoiced frames) and the aperiodicity at the chosen lag.
+def yin_frames(frames, framerate, fmin=60.0, fmax=4500.0, threshold=0.15):
+    frame_size = np.shape(frames)[1]
+    min_lag = max(2, int(framerate / fmax))
+    max_lag = min(int(np.ceil(framerate / fmin)), frame_size // 2)
+    if max_lag <= min_lag + 1:
+        return np.full(len(frames), np.nan), np.ones(len(frames))
+
+    cmndf = yin_difference(frames, max_lag)
+    d = cmndf[:, min_lag - 1 : max_lag + 1]
+    middle = d[:, 1:-1]
+    dip = (middle <= d[:, :-2]) & (middle <= d[:, 2:]) & (middle < threshold)
+    # Take the first dip below threshold, or the global minimum if there is none
+    has_dip = dip.any(axis=1)
+    index = np.where(has_dip, np.argmax(dip, axis=1), np.argmin(middle, axis=1))
+    rows = np.arange(len(d))
+
+    a, b, c = d[rows, index], d[rows, index + 1], d[rows, index + 2]
+    denom = a - 2 * b + c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shift = np.where(denom > 0, 0.5 * (a - c) / denom, 0.0)
+    lag = min_lag + index + np.clip(shift, -0.5, 0.5)
+    aperiodicity = b
+
+    f0 = np.where(has_dip, framerate / lag, np.nan)
+    return f0, aperiodicity
+
+
+# Pitch contour of one signal: frame times (centres, s), f0 per frame and the
+# aperiodicity. A signal shorter than frame_size is analysed as a single frame.
+def track_pitch(
+    signal,
+    framerate,
+    frame_size=2048,
+    hop_size=512,
+    fmin=60.0,
+    fmax=4500.0,
+    threshold=0.15,
+):
+    signal = np.asarray(signal)
+    frame_size = min(frame_size, len(signal))
+    if frame_size < 4:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    frames = sliding_window_view(signal, frame_size)[::hop_size]
+    f0 = np.empty(len(frames))
+    aperiodicity = np.empty(len(frames))
+    for start in range(0, len(frames), MAX_FRAMES_PER_BATCH):
+        stop = start + MAX_FRAMES_PER_BATCH
+        f0[start:stop], aperiodicity[start:stop] = yin_frames(
+            frames[start:stop], framerate, fmin, fmax, threshold
+        )
+
+    times = (np.arange(len(frames)) * hop_size + frame_size / 2) / framerate
+    return times, f0, aperiodicity
+
+
+# Contour and a single pitch for every segment. The single estimate is the median
+# of the voiced frames, NaN if no frame was voiced.
+def track_segment_pitches(segments, framerate, **kwargs):
+    contours = []
+    pitches = np.full(len(segments), np.nan)
+    for i, segment in enumerate(segments):
+        times, f0, aperiodicity = track_pitch(segment, framerate, **kwargs)
+        contours.append((times, f0, aperiodicity))
+        voiced = f0[~np.isnan(f0)]
+        if len(voiced):
+            pitches[i] = np.median(voiced)
+    return pitches, contours
@@ -1,32 +1,26 @@
-import numpy as np
-import wave
-
 import matplotlib.pyplot as plt
 
-WAV_FILE = "Assignment 1: Music Box/Pink_Panther_Music_Box.wav"  # Change to your actual file name
+from audio import read_wav_mmap
+from decimate import minmax_envelope
 
-with wave.open(WAV_FILE, "rb") as wf:
-    n_channels = wf.getnchannels()
-    sampwidth = wf.getsampwidth()
-    framerate = wf.getframerate()
-    n_frames = wf.getnframes()
-    audio_data = wf.readframes(n_frames)
+WAV_FILE = "Assignment 1: Music Box/Pink_Panther_Music_Box.wav"  # Change to your actual file name
 
-# Convert bytes to numpy array
-dtype = np.int16 if sampwidth == 2 else np.uint8
-audio = np.frombuffer(audio_data, dtype=dtype)
+# Memory-map the samples instead of copying them into memory
+audio, framerate = read_wav_mmap(WAV_FILE)
 
 # If stereo, take one channel
-if n_channels > 1:
-    audio = audio[::n_channels]
-
-time = np.linspace(0, n_frames / framerate, num=n_frames)
+audio = audio[:, 0]
 
 min_time_display = 0  # seconds
 max_time_display = min_time_display + 270  # seconds
 
+# Min/max envelope with a few thousand points instead of every sample
+envelope, time = minmax_envelope(
+    audio, framerate, t_start=min_time_display, t_end=max_time_display
+)
+
 plt.figure(figsize=(10, 4))
-plt.plot(time, audio)
+plt.plot(time, envelope)
 plt.title(f"Waveform of {WAV_FILE}")
 plt.xlabel("Time [s]")
 plt.ylabel("Amplitude")
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from decimate import minmax_envelope
+from helper_functions import get_saving_path
+
+# Digests of the inputs behind every rendered figure, used to skip unchanged ones
+MANIFEST_FILE = ".render_manifest.json"
+
+
+def _use_headless_backend():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+# Only the spectrum below xlim is drawn, max-pooled so no peak is lost
+def fft_plot_job(
+    fft_freqs, magnitude, harmonic_peaks=None, xlim=8000, index=None, n_points=4000
+):
+    n_bins = np.searchsorted(fft_freqs, xlim, side="right")
+    step = max(1, int(np.ceil(n_bins / n_points)))
+    n_bins = min(len(fft_freqs), -(-n_bins // step) * step)
+
+    # Normalise by the full spectrum so the cropped plot keeps the same 0 dB, and
+    # tell plot_fft not to normalise again by the cropped maximum
+    magnitude = magnitude[:n_bins] / np.max(magnitude)
+    freqs = fft_freqs[:n_bins:step]
+    pad = (-len(magnitude)) % step
+    pooled = np.pad(magnitude, (0, pad)).reshape(-1, step).max(axis=1)
+
+    path = get_saving_path("fft_spectrums", f"fft_spectrum_segment_{index}.png")
+    kwargs = {
+        "title": f"FFT Magnitude Spectrum for Note {index}",
+        "harmonic_peaks": None if harmonic_peaks is None else list(harmonic_peaks),
+        "xlim": xlim,
+        "index": index,
+        "show": False,
+        "save_path": path,
+        "normalize": False,
+    }
+    return ("fft", path, (freqs, pooled), kwargs)
+
+
+def waveform_plot_job(segment, framerate, index=None, n_pixels=2000):
+    decimated, times = minmax_envelope(segment, framerate, n_pixels)
+
+    path = get_saving_path("time_plots", f"time_plot_segment_{index}.png")
+    kwargs = {
+        "title": f"Waveform of Segment {index}",
+        "index": index,
+        "times": times,
+        "save_path": path,
+    }
+    return ("waveform", path, (decimated, framerate), kwargs)
+
+
+def _job_digest(job):
+    kind, path, args, kwargs = job
+    digest = hashlib.sha1(kind.encode())
+    for value in list(args) + [kwargs[key] for key in sorted(kwargs)]:
+        if isinstance(value, np.ndarray):
+            digest.update(str((value.dtype, value.shape)).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def _render_job(job):
+    kind, path, args, kwargs = job
+    if kind == "fft":
+        from fft import plot_fft
+
+        plot_fft(*args, **kwargs)
+    elif kind == "waveform":
+        from helper_functions import plot_waveform
+
+        plot_waveform(*args, **kwargs)
+    else:
+        raise ValueError(f"Unknown figure kind: {kind}")
+    return path
+
+
+# Render figure jobs on a process pool with the non-interactive Agg backend
+def render_figures(jobs, workers=None, skip_unchanged=True):
+    manifest_path = get_saving_path("", MANIFEST_FILE)
+    manifest = {}
+    if skip_unchanged and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # Keys are relative to the data folder so the manifest survives moving the repo
+    def key(path):
+        return os.path.relpath(path, os.path.dirname(manifest_path))
+
+    digests = {key(job[1]): _job_digest(job) for job in jobs}
+    pending = [
+        job
+        for job in jobs
+        if not (
+            skip_unchanged
+            and manifest.get(key(job[1])) == digests[key(job[1])]
+            and os.path.exists(job[1])
+        )
+    ]
+    print(f"Rendering {len(pending)} of {len(jobs)} figures")
+
+    if pending:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_use_headless_backend
+        ) as pool:
+            for path in pool.map(_render_job, pending):
+                manifest[key(path)] = digests[key(path)]
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return [job[1] for job in pending]
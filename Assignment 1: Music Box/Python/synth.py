@@ -0,0 +1,164 @@
+import wave
+
+import numpy as np
+
+# Attack and release ramps keep note boundaries free of clicks
+ATTACK = 0.005  # s
+RELEASE = 0.005  # s
+
+
+# Split possibly overlapping notes into voices in which notes follow each other
+def _assign_voices(starts, ends):
+    voices, voice_ends = [], []
+    for i in np.argsort(starts, kind="stable"):
+        for v, voice_end in enumerate(voice_ends):
+            if voice_end <= starts[i]:
+                voices[v].append(i)
+                voice_ends[v] = ends[i]
+                break
+        else:
+            voices.append([i])
+            voice_ends.append(ends[i])
+    return [np.array(voice) for voice in voices]
+
+
+# Per-note sample ranges, oscillator frequencies, amplitudes and start phases.
+# Each harmonic is an oscillator that keeps running from note to note within a
+# voice, so its phase is continuous across note boundaries.
+def _synth_plan(events, framerate, harmonic_freqs, harmonic_amplitudes, decay, gain):
+    starts = np.round(np.asarray(events["start"], dtype=np.float64) * framerate)
+    ends = np.round(np.asarray(events["end"], dtype=np.float64) * framerate)
+    starts, ends = starts.astype(np.int64), ends.astype(np.int64)
+    n = len(starts)
+    if n == 0:
+        return [], 0
+
+    if harmonic_freqs is None:
+        freqs = np.asarray(events["freq"], dtype=np.float64).reshape(n, 1)
+        amps = np.ones((n, 1))
+    else:
+        freqs = np.array(harmonic_freqs, dtype=np.float64).reshape(n, -1)
+        if harmonic_amplitudes is None:
+            amps = 1.0 / np.arange(1, freqs.shape[1] + 1) ** 2 * np.ones_like(freqs)
+        else:
+            amps = np.array(harmonic_amplitudes, dtype=np.float64).reshape(n, -1)
+
+    # Missing harmonics and notes are silent oscillators
+    missing = ~np.isfinite(freqs) | ~np.isfinite(amps) | (freqs <= 0)
+    freqs[missing] = 0.0
+    amps[missing] = 0.0
+    total = amps.sum(axis=1, keepdims=True)
+    amps = gain * np.divide(amps, total, out=np.zeros_like(amps), where=total > 0)
+    decay = np.broadcast_to(np.asarray(decay, dtype=np.float64), (n,))
+
+    voices = []
+    for index in _assign_voices(starts, ends):
+        # Cycles completed by each oscillator before the note starts
+        elapsed = np.diff(starts[index], prepend=starts[index[0]]) / framerate
+        previous = np.vstack((freqs[index[:1]], freqs[index[:-1]]))
+        phase0 = np.cumsum(previous * elapsed[:, None], axis=0) % 1.0
+        voices.append(
+            {
+                "start": starts[index],
+                "end": ends[index],
+                "freqs": freqs[index],
+                "amps": amps[index],
+                "phase0": phase0,
+                "decay": decay[index],
+            }
+        )
+    return voices, int(ends.max(initial=0))
+
+
+# Add one voice's samples first .. first + len(block) into block
+def _render_voice(block, first, voice, framerate):
+    n = first + np.arange(len(block))
+    note = np.searchsorted(voice["start"], n, side="right") - 1
+    active = note >= 0
+    active[active] &= n[active] < voice["end"][note[active]]
+    if not active.any():
+        return
+
+    n, note = n[active], note[active]
+    t = (n - voice["start"][note]) / framerate
+    duration = (voice["end"][note] - voice["start"][note]) / framerate
+    envelope = np.exp(-voice["decay"][note] * t)
+    envelope *= np.minimum(1.0, t / ATTACK)
+    envelope *= np.minimum(1.0, (duration - t) / RELEASE)
+
+    out = np.zeros(len(n))
+    for k in range(voice["freqs"].shape[1]):
+        phase = voice["phase0"][note, k] + voice["freqs"][note, k] * t
+        out += voice["amps"][note, k] * np.sin(2 * np.pi * phase)
+    block[active] += out * envelope
+
+
+# Render note events into one float32 buffer, allocated here unless out is given.
+# events needs start, end (s) and freq (Hz) columns, as made by note_events.
+# harmonic_freqs and harmonic_amplitudes are (n_notes, n_harmonics) arrays as
+# returned by find_harmonic_peaks_batched, NaN for a missing harmonic. decay is
+# the exponential decay rate in 1/s, for all notes or per note.
+def render_note_events(
+    events,
+    framerate=44100,
+    harmonic_freqs=None,
+    harmonic_amplitudes=None,
+    decay=3.0,
+    gain=0.3,
+    out=None,
+    block_size=65536,
+):
+    voices, n_samples = _synth_plan(
+        events, framerate, harmonic_freqs, harmonic_amplitudes, decay, gain
+    )
+    if out is None:
+        out = np.zeros(n_samples, dtype=np.float32)
+    else:
+        out[:] = 0
+
+    # Work through the buffer in blocks to bound the float64 temporaries
+    for first in range(0, len(out), block_size):
+        block = np.zeros(min(block_size, len(out) - first))
+        for voice in voices:
+            _render_voice(block, first, voice, framerate)
+        out[first : first + len(block)] = block
+    return out
+
+
+# Stream the rendering in blocks for playback. The same buffer is yielded every
+# time, so copy a block if it has to outlive the next one.
+def iter_note_event_blocks(
+    events,
+    framerate=44100,
+    harmonic_freqs=None,
+    harmonic_amplitudes=None,
+    decay=3.0,
+    gain=0.3,
+    block_size=4096,
+):
+    voices, n_samples = _synth_plan(
+        events, framerate, harmonic_freqs, harmonic_amplitudes, decay, gain
+    )
+
+    block = np.empty(block_size)
+    out = np.empty(block_size, dtype=np.float32)
+    for first in range(0, n_samples, block_size):
+        length = min(block_size, n_samples - first)
+        block[:length] = 0
+        for voice in voices:
+            _render_voice(block[:length], first, voice, framerate)
+        out[:length] = block[:length]
+        yield out[:length]
+
+
+# Render note events straight to a 16-bit mono WAV file, one block at a time
+def write_note_events_wav(wav_file, events, framerate=44100, **synth_kwargs):
+    with wave.open(wav_file, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(framerate)
+        for block in iter_note_event_blocks(
+            events, framerate, block_size=65536, **synth_kwargs
+        ):
+            pcm = np.clip(block, -1.0, 1.0) * 32767
+            wf.writeframes(pcm.astype("<i2").tobytes())
@@ -0,0 +1,75 @@
+import numpy as np
+
+from hrir import itd_samples
+from hrtf import hrtfiir_batch
+
+
+# TASK 1 + 3: Combined binaural filter, the first-order head-shadow IIR of hrtfiir
+# followed by the interaural delay of hrir1 as a delay line, for arrays of angles
+# and head radii broadcast against each other. The left and right ear are the
+# last axis of b_0, b_1 and delay.
+class BinauralFilter:
+    def __init__(self, angle, head_radius=0.09, f_s=44100, c=343):
+        delay_left, delay_right = itd_samples(angle, head_radius, f_s, c)
+        if delay_left is None:
+            raise ValueError("Angle must be between -90 and 90 degrees.")
+        A_1, B_0_L, B_1_L, B_0_R, B_1_R = hrtfiir_batch(angle, head_radius, f_s, c)
+
+        self.a_1 = A_1
+        self.b_0 = np.stack((B_0_L, B_0_R), axis=-1)
+        self.b_1 = np.stack((B_1_L, B_1_R), axis=-1)
+        self.delay = np.stack((delay_left, delay_right), axis=-1)
+
+    # Filter the sources x (..., N), one mono signal per source or one shared by
+    # all of them, and return the (..., 2, N) ear signals with the final state.
+    # As with lfilter's zi, pass zi=None for the first block and the returned
+    # state with the next one; block boundaries then leave no trace.
+    #
+    # The pole 1 / (1 + a_1 z^-1) is the same for both ears and, since a_1 only
+    # depends on the head radius, runs once per source in one lfilter call per
+    # distinct head. Each ear then reads b_0 p[n - delay] + b_1 p[n - 1 - delay]
+    # from the pole's output p, kept in a line that carries the last samples over
+    # to the next block, so the delay needs no convolution with the HRIR.
+    def lfilter(self, x, zi=None):
+        from scipy.signal import lfilter
+
+        x = np.asarray(x)
+        dtype = x.dtype if x.dtype.kind == "f" else np.float64
+        shape = np.broadcast_shapes(x.shape[:-1], np.shape(self.a_1))
+        x = np.broadcast_to(x, shape + x.shape[-1:]).astype(dtype, copy=False)
+        n = x.shape[-1]
+        a_1 = np.broadcast_to(self.a_1, shape)
+        b_0 = np.broadcast_to(self.b_0, shape + (2,)).astype(dtype)
+        b_1 = np.broadcast_to(self.b_1, shape + (2,)).astype(dtype)
+        delay = np.broadcast_to(self.delay, shape + (2,))
+        max_delay = int(np.max(delay, initial=0))
+
+        if zi is None:
+            history = np.zeros(shape + (max_delay + 1,), dtype=dtype)
+            iir_zi = np.zeros(shape + (1,), dtype=dtype)
+        else:
+            history, iir_zi = zi
+        if n == 0:
+            return np.empty(shape + (2, 0), dtype=dtype), (history, iir_zi)
+
+        pole = np.empty(shape + (n,), dtype=dtype)
+        iir_zf = np.empty_like(iir_zi)
+        for value in np.unique(a_1):
+            rows = a_1 == value
+            pole[rows], iir_zf[rows] = lfilter(
+                [1.0], [1.0, value], x[rows], axis=-1, zi=iir_zi[rows]
+            )
+
+        line = np.concatenate((history, pole), axis=-1)
+        out = np.empty(shape + (2, n), dtype=dtype)
+        for ear in range(2):
+            for value in np.unique(delay[..., ear]):
+                rows = delay[..., ear] == value
+                start = max_delay + 1 - value
+                samples = line[rows]
+                out[rows, ear] = b_0[rows, ear, None] * samples[..., start : start + n]
+                out[rows, ear] += (
+                    b_1[rows, ear, None] * samples[..., start - 1 : start - 1 + n]
+                )
+
+        return out, (line[..., n:].copy(), iir_zf)
@@ -0,0 +1,105 @@
+import numpy as np
+
+# Samples per block, 11.6 ms at 44.1 kHz
+block_size = 512
+
+
+# Uniformly partitioned FFT convolution. A filter is cut into partitions of
+# block_size taps, and each partition is transformed once with 2 * block_size
+# points. A block of input is transformed once, kept in a delay line of block
+# spectra, and multiplied with every partition. The cost per block is one
+# forward and one inverse transform plus one complex multiply-add per partition
+# and bin, so it does not grow with the filter length beyond the partition count.
+
+
+# Spectra of the partitions of filters (..., n_taps), e.g. the (2, n_taps) filters
+# of both ears, as a (..., n_parts, block_size + 1) array
+def partition_filters(filters, block_size=block_size):
+    import scipy.fft
+
+    filters = np.asarray(filters)
+    n_taps = filters.shape[-1]
+    n_parts = max(1, -(-n_taps // block_size))
+
+    padded = np.zeros(filters.shape[:-1] + (n_parts * block_size,), filters.dtype)
+    padded[..., :n_taps] = filters
+    parts = padded.reshape(filters.shape[:-1] + (n_parts, block_size))
+    return scipy.fft.rfft(parts, 2 * block_size, axis=-1)
+
+
+# Full convolution of signal (..., N) with the partitioned filters in one pass over
+# all blocks, or its centre as np.convolve's "same" mode. A mono signal is
+# transformed once and shared by all filters, so both ears cost one forward
+# transform and one batched inverse transform per block.
+def convolve_partitioned(signal, spectra, n_taps, mode="full"):
+    import scipy.fft
+
+    signal = np.asarray(signal)
+    n_parts, block = spectra.shape[-2], spectra.shape[-1] - 1
+    length = signal.shape[-1]
+    n_blocks = max(1, -(-length // block))
+
+    padded = np.zeros(signal.shape[:-1] + (n_blocks * block,), signal.dtype)
+    padded[..., :length] = signal
+    blocks = padded.reshape(signal.shape[:-1] + (n_blocks, block))
+    input_spectra = scipy.fft.rfft(blocks, 2 * block, axis=-1)
+    del padded, blocks
+
+    # Output block b collects input block b - p times partition p
+    batch = np.broadcast_shapes(signal.shape[:-1], spectra.shape[:-2])
+    output_spectra = np.zeros(
+        batch + (n_blocks + n_parts - 1, block + 1),
+        np.result_type(input_spectra, spectra),
+    )
+    for p in range(n_parts):
+        output_spectra[..., p : p + n_blocks, :] += (
+            input_spectra * spectra[..., p, None, :]
+        )
+    del input_spectra
+    output = scipy.fft.irfft(output_spectra, 2 * block, axis=-1)
+    del output_spectra
+
+    # Overlap-add: the second half of every block spills into the next
+    out = np.zeros(batch + (n_blocks + n_parts, block), output.dtype)
+    out[..., :-1, :] += output[..., :block]
+    out[..., 1:, :] += output[..., block:]
+    out = out.reshape(batch + (-1,))[..., : length + n_taps - 1]
+
+    if mode == "same":
+        start = (min(length, n_taps) - 1) // 2
+        return out[..., start : start + max(length, n_taps)]
+    if mode != "full":
+        raise ValueError(f"Unknown convolution mode: {mode}")
+    return out
+
+
+# Convolve one block of block_size samples, for real-time use. state carries the
+# delay line of earlier block spectra and the overlap into the next block; pass
+# None for the first block and the returned state for the next one, as zi in
+# lfilter. Feed n_taps - 1 samples of zeros after the signal to flush the tail.
+def convolve_block(block, spectra, state=None):
+    import scipy.fft
+
+    block = np.asarray(block)
+    n_parts, size = spectra.shape[-2], spectra.shape[-1] - 1
+    if block.shape[-1] != size:
+        raise ValueError(f"Block has {block.shape[-1]} samples, expected {size}")
+
+    block_spectrum = scipy.fft.rfft(block, 2 * size, axis=-1)
+    if state is None:
+        history = np.zeros(
+            block_spectrum.shape[:-1] + (n_parts, size + 1), block_spectrum.dtype
+        )
+        tail = None
+    else:
+        history, tail = state
+
+    # Newest block spectrum first, so history[..., p, :] meets partition p
+    history = np.roll(history, 1, axis=-2)
+    history[..., 0, :] = block_spectrum
+    output = scipy.fft.irfft(np.sum(history * spectra, axis=-2), 2 * size, axis=-1)
+
+    out = output[..., :size]
+    if tail is not None:
+        out += tail
+    return out, (history, output[..., size:])
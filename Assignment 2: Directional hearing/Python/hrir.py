@@ -32,3 +32,42 @@ def hrir1(angle, head_radius, f_s, c):
         hrir_right[0] = 1.0
 
     return hrir_left, hrir_right
+
+
+# TASK 1: HRIR model for arrays of angles and head radii. angle and head_radius
+# are broadcast against each other, and row i of the (..., taps) outputs is
+# hrir1 for the i-th pair. All rows get the taps of the largest head, so they
+# can be stacked; the extra taps are zero.
+def hrir1_batch(angle, head_radius, f_s, c):
+    delay_left, delay_right = itd_samples(angle, head_radius, f_s, c)
+    if delay_left is None:
+        return None, None
+
+    n_max = int(np.rint(np.max(head_radius, initial=0) / c * (np.pi / 2 + 1) * f_s))
+
+    hrir_left = np.zeros(delay_left.shape + (n_max + 1,))
+    hrir_right = np.zeros(delay_right.shape + (n_max + 1,))
+    np.put_along_axis(hrir_left, delay_left[..., None], 1.0, -1)
+    np.put_along_axis(hrir_right, delay_right[..., None], 1.0, -1)
+
+    return hrir_left, hrir_right
+
+
+# Delay of each ear in whole samples, as in hrir1: 0 for the ear facing the
+# source and the interaural time difference for the other one. angle and
+# head_radius are broadcast against each other.
+def itd_samples(angle, head_radius, f_s, c):
+    angle, head_radius = np.broadcast_arrays(
+        np.asarray(angle, dtype=float), np.asarray(head_radius, dtype=float)
+    )
+    if np.any((angle < -90) | (angle > 90)):
+        print("Angle must be between -90 and 90 degrees.")
+        return None, None
+
+    theta = np.radians(angle)
+    delta_t = (head_radius / c) * (theta + np.sin(theta))
+    n_delay = np.rint(np.abs(delta_t) * f_s).astype(int)
+
+    delay_left = np.where(angle > 0, n_delay, 0)
+    delay_right = np.where(angle < 0, n_delay, 0)
+    return delay_left, delay_right
@@ -0,0 +1,45 @@
+import numpy as np
+
+# Pinking filter for white noise at 44.1 kHz: -3 dB per octave to within 0.6 dB
+# from 20 Hz to 20 kHz. At other rates the slope holds over a scaled band.
+pink_b = np.array([0.049922035, -0.095993537, 0.050612699, -0.004408786])
+pink_a = np.array([1, -2.494956002, 2.017265875, -0.522189400])
+
+# Samples run through the filter before the first output, so the output starts
+# in its steady state. The slowest pole (0.995) decays by e^-20 in this time.
+pink_warmup = 4096
+
+# White noise generated and filtered at once
+noise_chunk = 65536
+
+
+# Fill out with pink noise, continuing from the filter state zi, and return the
+# state to pass with the next buffer. zi=None starts a new stream. rng is a
+# numpy.random.Generator; the output has an RMS of about 0.09 and peaks below 0.5.
+# Memory use is bounded by noise_chunk, whatever the length of out.
+def fill_pink_noise(out, rng, zi=None):
+    from scipy.signal import lfilter
+
+    if zi is None:
+        _, zi = lfilter(
+            pink_b, pink_a, rng.standard_normal(pink_warmup), zi=np.zeros(3)
+        )
+    for start in range(0, len(out), noise_chunk):
+        stop = min(len(out), start + noise_chunk)
+        out[start:stop], zi = lfilter(
+            pink_b, pink_a, rng.standard_normal(stop - start), zi=zi
+        )
+    return zi
+
+
+# Endless pink noise in blocks of block_size. The same buffer, out if given, is
+# filled and yielded every time, so copy a block if it has to outlive the next
+# one. seed may be an int or a numpy.random.Generator.
+def iter_pink_noise(block_size=4096, seed=None, dtype=np.float32, out=None):
+    rng = np.random.default_rng(seed)
+    if out is None:
+        out = np.empty(block_size, dtype=dtype)
+    zi = None
+    while True:
+        zi = fill_pink_noise(out, rng, zi)
+        yield out
@@ -0,0 +1,74 @@
+import tempfile
+import wave
+
+import numpy as np
+
+from convolution import block_size, convolve_partitioned, partition_filters
+
+# Samples scaled and written to the WAV file at once
+wav_chunk = 65536
+
+
+# Samples in a sweep of n_angles renders of n_samples, each followed by gap samples
+def sweep_length(n_angles, n_samples, gap):
+    return n_angles * (n_samples + gap)
+
+
+# Render a sweep into out, a (sweep_length, 2) array such as an np.memmap, and
+# return its peak. For each (2, n_taps) filter pair in filters, source(n_samples)
+# gives the mono signal that is convolved with it, followed by gap samples of
+# silence. Only one angle is held in memory besides out.
+def _render_sweep_into(out, filters, source, n_samples, gap):
+    n_taps = filters.shape[-1]
+    peak = 0.0
+    for i, combined in enumerate(filters):
+        start = i * (n_samples + gap)
+        filter_spectra = partition_filters(combined, block_size)
+        stereo_signal = convolve_partitioned(
+            source(n_samples), filter_spectra, n_taps, "same"
+        )
+        out[start : start + n_samples] = stereo_signal.T
+        out[start + n_samples : start + n_samples + gap] = 0
+        peak = max(peak, float(np.max(np.abs(stereo_signal), initial=0)))
+    return peak
+
+
+# Angle sweep as one preallocated (n_angles * (n_samples + gap), 2) buffer. out
+# may be given, e.g. an np.memmap for sweeps that do not fit in memory. The
+# running peak of the renders normalizes the buffer in place at the end.
+def render_sweep(
+    filters, source, n_samples, gap, out=None, normalize=True, dtype=np.float32
+):
+    filters = np.asarray(filters)
+    total = sweep_length(len(filters), n_samples, gap)
+    if out is None:
+        out = np.empty((total, 2), dtype=dtype)
+    elif out.shape != (total, 2):
+        raise ValueError(f"out has shape {out.shape}, expected {(total, 2)}")
+
+    peak = _render_sweep_into(out, filters, source, n_samples, gap)
+    if normalize and peak > 0:
+        for start in range(0, total, wav_chunk):
+            out[start : start + wav_chunk] /= peak
+    return out
+
+
+# Stream an angle sweep to a 16-bit stereo WAV file. The renders go to a
+# temporary memory-mapped file first, and a second pass scales them by their
+# peak into the WAV file, so memory use does not grow with the sweep.
+def write_sweep_wav(wav_file, filters, source, n_samples, gap, f_s):
+    filters = np.asarray(filters)
+    total = sweep_length(len(filters), n_samples, gap)
+    with tempfile.TemporaryFile() as tmp:
+        buffer = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(total, 2))
+        peak = _render_sweep_into(buffer, filters, source, n_samples, gap)
+        scale = 32767 / peak if peak > 0 else 0.0
+
+        with wave.open(wav_file, "wb") as wf:
+            wf.setnchannels(2)
+            wf.setsampwidth(2)
+            wf.setframerate(f_s)
+            for start in range(0, total, wav_chunk):
+                pcm = np.rint(buffer[start : start + wav_chunk] * scale)
+                wf.writeframes(pcm.astype("<i2").tobytes())
+        del buffer